@@ -0,0 +1,169 @@
+"""Microbenchmarks for gemini_pro_bot.html_format.
+
+Runs every formatter entry point over the markdown files in `benchmarks/corpus`
+and reports throughput, p50/p99 latency and peak memory allocated per call.
+
+Usage:
+    python benchmarks/bench_html_format.py                  # run and compare to baseline
+    python benchmarks/bench_html_format.py --save-baseline  # store results as the new baseline
+
+Baselines are machine specific, so save one on the machine you compare on.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gemini_pro_bot import html_format  # noqa: E402
+
+CORPUS_DIR = os.path.join(ROOT, "benchmarks", "corpus")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+
+def load_corpus() -> dict:
+    """Load every corpus file, plus a concatenation of all of them as a worst case."""
+    corpus = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".md"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+                corpus[name[:-3]] = f.read()
+    corpus["all_concatenated"] = "\n\n".join(corpus.values())
+    return corpus
+
+
+def get_benchmarks() -> dict:
+    """Map benchmark names to a callable taking the raw markdown text.
+
+    Inputs are prepared the way the bot prepares them, e.g. the `apply_*` helpers
+    receive already-escaped text and `split_message` receives formatted HTML.
+    """
+    helpers = {
+        name: getattr(html_format, name)
+        for name in (
+            "apply_header",
+            "apply_link",
+            "apply_bold",
+            "apply_italic",
+            "apply_underline",
+            "apply_strikethrough",
+            "apply_monospace",
+            "apply_hand_points",
+            "apply_code",
+        )
+    }
+    benchmarks = {
+        "format_message": (lambda text: text, html_format.format_message),
+        "split_message": (html_format.format_message, html_format.split_message),
+        "escape_html": (lambda text: text, html_format.escape_html),
+        "apply_exclude_code": (html_format.escape_html, html_format.apply_exclude_code),
+    }
+    for name, func in helpers.items():
+        benchmarks[name] = (html_format.escape_html, func)
+    return benchmarks
+
+
+def measure(func, arg, iterations: int) -> dict:
+    """Time `func(arg)` and measure the memory it allocates per call."""
+    for _ in range(min(10, iterations)):
+        func(arg)
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(min(20, iterations)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func(arg)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    total = sum(timings)
+    return {
+        "ops_per_sec": iterations / total,
+        "mb_per_sec": len(arg.encode("utf-8")) * iterations / total / 1e6,
+        "p50_us": statistics.median(timings) * 1e6,
+        "p99_us": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e6,
+        "alloc_bytes": statistics.median(peaks),
+    }
+
+
+def run(iterations: int, only: str = None) -> dict:
+    """Run all benchmarks over the corpus and return the results keyed by name."""
+    corpus = load_corpus()
+    results = {}
+    for bench, (prepare, func) in get_benchmarks().items():
+        if only and only not in bench:
+            continue
+        for doc, text in corpus.items():
+            results[f"{bench}:{doc}"] = measure(func, prepare(text), iterations)
+    return results
+
+
+def print_results(results: dict, baseline: dict, threshold: float) -> list:
+    """Print a results table and return the keys that regressed against the baseline."""
+    regressions = []
+    header = f"{'benchmark':<42} {'ops/s':>10} {'MB/s':>8} {'p50 us':>10} {'p99 us':>10} {'alloc KiB':>10} {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for key, r in results.items():
+        change = ""
+        if key in baseline:
+            ratio = r["p50_us"] / baseline[key]["p50_us"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > threshold:
+                regressions.append(key)
+                change += " !"
+        print(
+            f"{key:<42} {r['ops_per_sec']:>10.0f} {r['mb_per_sec']:>8.1f} "
+            f"{r['p50_us']:>10.1f} {r['p99_us']:>10.1f} {r['alloc_bytes'] / 1024:>10.1f} {change:>8}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("-k", "--only", help="only run benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.15,
+        help="fail if p50 latency is this much slower than the baseline (default 0.15)",
+    )
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.only)
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = print_results(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}:")
+        for key in regressions:
+            print(f"  {key}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+"""End-to-end load test of the bot against local stand-ins for the Bot API and Gemini.
+
+Drives synthetic or recorded updates (text, photos, model selections, /new)
+through the real Application and handlers built by
+`gemini_pro_bot.bot.build_application`. A fake Bot API server and a fake Gemini
+backend answer with configurable latency, errors and quota limits. Reports
+sustained updates/s, end-to-end latency percentiles per kind of update, Bot API
+traffic and memory growth per active chat.
+
+Usage:
+    python benchmarks/load_test.py                                    # 100 chats, 10 updates/s, 30s
+    python benchmarks/load_test.py --chats 500 --rate 50 --duration 120
+    python benchmarks/load_test.py --gemini-latency 3 --error-rate 0.05 --gemini-rpm 60
+    python benchmarks/load_test.py --updates recorded.jsonl --rate 0  # replay as fast as possible
+
+Recorded updates are Bot API `Update` objects, one JSON object per line. Photos
+in recorded updates are all served from the same synthetic image. Identical
+prompts may be answered from the bot's response cache, so there can be fewer
+Gemini calls than updates.
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from http import HTTPStatus
+from io import BytesIO
+from urllib.parse import parse_qs, quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TOKEN = "123456:LOAD-TEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Load Test", "username": "load_test_bot"}
+PHOTO_SIZES = ((90, 90), (320, 320), (1280, 960))
+PROMPTS = (
+    "Explain how a hash map works",
+    "Write a haiku about the sea",
+    "What is the capital of Australia?",
+    "Give me a Python function that reverses a linked list",
+    "Summarize the plot of Hamlet in three sentences",
+    "How do I center a div?",
+)
+REPLY = (
+    "## Answer\n\nHere is a **short** explanation with a bit of `inline code` and a list:\n\n"
+    "* first point with *emphasis*\n* second point\n\n"
+    "```python\ndef example():\n    return 42\n```\n\n"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure_environment(args, port: int) -> None:
+    """Point the bot at the fakes. Must run before `gemini_pro_bot` is imported."""
+    os.environ.update(
+        {
+            "BOT_TOKEN": TOKEN,
+            "TELEGRAM_BASE_URL": f"http://127.0.0.1:{port}/bot",
+            "TELEGRAM_BASE_FILE_URL": f"http://127.0.0.1:{port}/file/bot",
+            "GOOGLE_API_KEY": "load-test",
+            "SESSION_DB_PATH": "",
+            "AUTHORIZED_USERS": "",
+            "HEALTH_CHECK_INTERVAL": "0",
+            "METRICS_PORT": "0",
+            "STRUCTURED_LOGS": "false",
+        }
+    )
+    if args.no_flood_limits:
+        os.environ["TELEGRAM_GLOBAL_RATE"] = "1000000"
+        os.environ["TELEGRAM_CHAT_RATE"] = "1000000"
+        os.environ["TELEGRAM_GROUP_RPM"] = "1000000"
+    if not args.bot_quotas:
+        from gemini_pro_bot.llm import AVAILABLE_MODELS
+
+        os.environ["MODEL_RPM"] = ",".join(
+            f"{m['id']}=1000000" for m in AVAILABLE_MODELS.values()
+        )
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    import PIL.Image as load_image
+
+    image = load_image.new("RGB", (width, height), (40, 120, 200))
+    output = BytesIO()
+    image.save(output, format="JPEG")
+    return output.getvalue()
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def memory_usage() -> int:
+    """Bytes allocated by Python objects (with --tracemalloc) or the process RSS."""
+    gc.collect()
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class FakeBotAPI:
+    """Answers the Bot API methods the bot uses, with optional latency and flood limits."""
+
+    METHODS = (
+        "getMe",
+        "sendMessage",
+        "editMessageText",
+        "sendChatAction",
+        "getFile",
+        "setWebhook",
+        "deleteWebhook",
+        "answerInlineQuery",
+    )
+
+    def __init__(self, latency: float, rate_limit: float):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.calls = Counter()
+        self.flood_errors = 0
+        self._recent = deque()
+        self._message_ids = itertools.count(1_000_000)
+        self._photo = make_jpeg(*PHOTO_SIZES[-1])
+
+    def add_routes(self, server) -> None:
+        for method in self.METHODS:
+            server.add_route("POST", f"/bot{TOKEN}/{method}", self._route(method))
+        # File URLs carry the token percent-encoded
+        server.add_route("GET", f"/file/bot{quote(TOKEN)}/photos/photo.jpg", self._download)
+
+    def _route(self, method: str):
+        async def handle(headers: dict, body: bytes) -> tuple:
+            return await self.handle(method, body)
+
+        return handle
+
+    async def _download(self, headers: dict, body: bytes) -> tuple:
+        self.calls["download"] += 1
+        await asyncio.sleep(self.latency)
+        return HTTPStatus.OK, "image/jpeg", self._photo
+
+    def _flooded(self) -> bool:
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            return True
+        self._recent.append(now)
+        return False
+
+    async def handle(self, method: str, body: bytes) -> tuple:
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method not in ("getMe", "getFile") and self._flooded():
+            self.flood_errors += 1
+            payload = {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }
+            return HTTPStatus.TOO_MANY_REQUESTS, "application/json", json.dumps(payload).encode()
+        params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        payload = {"ok": True, "result": self.result(method, params)}
+        return HTTPStatus.OK, "application/json", json.dumps(payload).encode()
+
+    def result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            message_id = params.get("message_id") or next(self._message_ids)
+            return {
+                "message_id": int(message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self._photo),
+                "file_path": "photos/photo.jpg",
+            }
+        return True
+
+
+class FakeGemini:
+    """Stands in for the Gemini API behind `google.generativeai.GenerativeModel`.
+
+    Latency is log-normally distributed around `latency` seconds until the first
+    chunk; streamed replies arrive in `chunks` parts `chunk_interval` apart.
+    Calls fail with 503 at `error_rate`, and with 429 once a model got more than
+    `rpm` calls within a minute.
+    """
+
+    def __init__(self, latency, sigma, error_rate, rpm, chunks, chunk_interval, reply_chars):
+        self.latency = latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.chunks = chunks
+        self.chunk_interval = chunk_interval
+        self.reply = (REPLY * (reply_chars // len(REPLY) + 1))[:reply_chars]
+        self.calls = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+        self._recent = {}
+
+    def install(self) -> None:
+        """Replace `GenerativeModel` in the SDK with one backed by this fake."""
+        from gemini_pro_bot.llm import load_sdk
+        from google.ai import generativelanguage as glm
+
+        genai = load_sdk()
+        fake = self
+
+        class FakeGenerativeModel(genai.GenerativeModel):
+            def generate_content(self, contents, *, stream=False, **kwargs):
+                return fake.generate(self.model_name.split("/")[-1], stream)
+
+            def count_tokens(self, contents, request_options=None):
+                return glm.CountTokensResponse(total_tokens=1)
+
+        genai.GenerativeModel = FakeGenerativeModel
+
+    def _check_quota(self, model: str) -> None:
+        from google.api_core.exceptions import ResourceExhausted
+
+        if not self.rpm:
+            return
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent.setdefault(model, deque())
+            while recent and now - recent[0] > 60:
+                recent.popleft()
+            if len(recent) >= self.rpm:
+                self.errors["ResourceExhausted"] += 1
+                raise ResourceExhausted("429 Quota exceeded (fake)")
+            recent.append(now)
+
+    def _chunk(self, text: str, last: bool):
+        from google.ai import generativelanguage as glm
+
+        return glm.GenerateContentResponse(
+            candidates=[
+                glm.Candidate(
+                    content=glm.Content(role="model", parts=[glm.Part(text=text)]),
+                    finish_reason=(
+                        glm.Candidate.FinishReason.STOP
+                        if last
+                        else glm.Candidate.FinishReason.FINISH_REASON_UNSPECIFIED
+                    ),
+                    index=0,
+                )
+            ]
+        )
+
+    def generate(self, model: str, stream: bool):
+        """Blocking, like the SDK call it replaces; runs on the bot's LLM executor."""
+        from google.api_core.exceptions import ServiceUnavailable
+        from google.generativeai.types.generation_types import GenerateContentResponse
+
+        with self._lock:
+            self.calls[model] += 1
+        self._check_quota(model)
+        time.sleep(random.lognormvariate(math.log(self.latency), self.sigma))
+        if random.random() < self.error_rate:
+            with self._lock:
+                self.errors["ServiceUnavailable"] += 1
+            raise ServiceUnavailable("503 The model is overloaded (fake)")
+
+        if not stream:
+            return GenerateContentResponse.from_response(self._chunk(self.reply, True))
+        size = max(1, math.ceil(len(self.reply) / self.chunks))
+        parts = [self.reply[i : i + size] for i in range(0, len(self.reply), size)]
+
+        def chunks():
+            for i, part in enumerate(parts):
+                if i:
+                    time.sleep(self.chunk_interval)
+                yield self._chunk(part, i == len(parts) - 1)
+
+        return GenerateContentResponse.from_iterator(chunks())
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def synthetic_updates(chats: int, mix: dict):
+    """Yield `(kind, update)` pairs of random traffic from `chats` private chats."""
+    message_ids = Counter()
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    for update_id in itertools.count(1):
+        chat_id = random.randint(1, chats)
+        kind = random.choices(kinds, weights)[0]
+        message_ids[chat_id] += 1
+        message = {
+            "message_id": message_ids[chat_id],
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "User"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+        }
+        if kind == "text":
+            message["text"] = random.choice(PROMPTS)
+        elif kind == "photo":
+            message["photo"] = [
+                {
+                    "file_id": f"photo{chat_id % 8}_{w}",
+                    "file_unique_id": f"u{chat_id % 8}_{w}",
+                    "width": w,
+                    "height": h,
+                    "file_size": w * h // 10,
+                }
+                for w, h in PHOTO_SIZES
+            ]
+            message["caption"] = "What is in this picture?"
+        elif kind == "model":
+            message["text"] = random.choice("1234")
+        elif kind == "new":
+            message["text"] = "/new"
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": 4}]
+        else:
+            raise ValueError(f"Unknown update kind: {kind}")
+        yield kind, {"update_id": update_id, "message": message}
+
+
+def classify(update: dict) -> str:
+    message = update.get("message") or {}
+    text = message.get("text", "")
+    if "photo" in message:
+        return "photo"
+    if text.startswith("/"):
+        return text.split()[0].split("@")[0][1:] or "command"
+    if text.strip().isdigit():
+        return "model"
+    return "text" if text else "other"
+
+
+def recorded_updates(path: str):
+    """Yield `(kind, update)` pairs from a JSONL file, repeating it as needed."""
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    if not updates:
+        raise SystemExit(f"No updates in {path}")
+    for update_id, update in zip(itertools.count(1), itertools.cycle(updates)):
+        update = dict(update, update_id=update_id)
+        yield classify(update), update
+
+
+class Tracker:
+    """Records when each update was submitted and when its handlers finished."""
+
+    def __init__(self):
+        self.submitted = {}
+        self.latencies = {}
+        self.errors = Counter()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def submit(self, update_id: int, kind: str) -> None:
+        self.submitted[update_id] = (kind, time.perf_counter())
+        self.idle.clear()
+
+    async def on_done(self, update, context) -> None:
+        entry = self.submitted.pop(update.update_id, None)
+        if entry is not None:
+            kind, started = entry
+            self.latencies.setdefault(kind, []).append(time.perf_counter() - started)
+        if not self.submitted:
+            self.idle.set()
+
+    async def on_error(self, update, context) -> None:
+        self.errors[type(context.error).__name__] += 1
+
+    @property
+    def completed(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+
+async def run(args) -> dict:
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from gemini_pro_bot.bot import build_application
+    from gemini_pro_bot.lifecycle import shutdown_application
+    from gemini_pro_bot.webhook import HTTPServer
+
+    fake_api = FakeBotAPI(args.api_latency, args.api_rate_limit)
+    server = HTTPServer("127.0.0.1", args.port)
+    fake_api.add_routes(server)
+    await server.start()
+
+    fake_gemini = FakeGemini(
+        args.gemini_latency,
+        args.gemini_sigma,
+        args.error_rate,
+        args.gemini_rpm,
+        args.chunks,
+        args.chunk_interval,
+        args.reply_chars,
+    )
+    fake_gemini.install()
+
+    application = build_application(webhook=True)
+    tracker = Tracker()
+    application.add_handler(TypeHandler(Update, tracker.on_done), group=1)
+    application.add_error_handler(tracker.on_error)
+
+    if args.updates:
+        updates = recorded_updates(args.updates)
+    else:
+        updates = synthetic_updates(args.chats, parse_mix(args.mix))
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    memory_before = memory_usage()
+    started = time.perf_counter()
+    submitted = 0
+    try:
+        while time.perf_counter() - started < args.duration:
+            kind, data = next(updates)
+            tracker.submit(data["update_id"], kind)
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            submitted += 1
+            if args.rate:
+                delay = started + submitted / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        try:
+            await asyncio.wait_for(tracker.idle.wait(), args.drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"{len(tracker.submitted)} updates still running after {args.drain_timeout}s")
+        elapsed = time.perf_counter() - started
+        active_chats = len(application.chat_data)
+        memory_after = memory_usage()
+    finally:
+
+        async def stop_receiving() -> None:
+            pass
+
+        await shutdown_application(application, stop_receiving)
+        await server.stop()
+
+    growth = memory_after - memory_before
+    return {
+        "duration": elapsed,
+        "submitted": submitted,
+        "completed": tracker.completed,
+        "updates_per_second": tracker.completed / elapsed,
+        "latency": {
+            kind: {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p90": percentile(values, 0.9),
+                "p99": percentile(values, 0.99),
+                "max": max(values),
+            }
+            for kind, values in sorted(tracker.latencies.items())
+        },
+        "handler_errors": dict(tracker.errors),
+        "bot_api_calls": dict(fake_api.calls),
+        "bot_api_flood_errors": fake_api.flood_errors,
+        "gemini_calls": dict(fake_gemini.calls),
+        "gemini_errors": dict(fake_gemini.errors),
+        "active_chats": active_chats,
+        "memory_growth_bytes": growth,
+        "memory_per_chat_bytes": growth / active_chats if active_chats else 0,
+    }
+
+
+def print_report(args, results: dict) -> None:
+    print(
+        f"\n{results['duration']:.1f}s, {args.chats if not args.updates else 'recorded'} chats, "
+        f"target {args.rate or 'max'} updates/s"
+    )
+    print(
+        f"  submitted {results['submitted']}, completed {results['completed']}, "
+        f"sustained {results['updates_per_second']:.1f} updates/s"
+    )
+    print(f"  {'latency (s)':<14} {'count':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for kind, row in results["latency"].items():
+        print(
+            f"  {kind:<14} {row['count']:>7} {row['p50']:>8.3f} {row['p90']:>8.3f} "
+            f"{row['p99']:>8.3f} {row['max']:>8.3f}"
+        )
+    calls = ", ".join(f"{k} {v}" for k, v in sorted(results["bot_api_calls"].items()))
+    print(f"  Bot API calls: {calls} (429s: {results['bot_api_flood_errors']})")
+    gemini = sum(results["gemini_calls"].values())
+    print(f"  Gemini calls: {gemini}, errors: {results['gemini_errors'] or 'none'}")
+    print(f"  handler errors: {results['handler_errors'] or 'none'}")
+    per_chat = results["memory_per_chat_bytes"] / 1024
+    print(
+        f"  memory: {results['memory_growth_bytes'] / 2**20:+.1f} MiB for "
+        f"{results['active_chats']} active chats ({per_chat:.1f} KiB per chat)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=100, help="number of synthetic chats")
+    parser.add_argument("--rate", type=float, default=10, help="updates per second (0: as fast as possible)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to send updates for")
+    parser.add_argument(
+        "--mix",
+        default="text=85,photo=5,model=5,new=5",
+        help="relative weights of synthetic update kinds",
+    )
+    parser.add_argument("--updates", help="JSONL file of recorded updates to replay instead")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="seconds to wait for running updates at the end")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="seconds per fake Bot API call")
+    parser.add_argument("--api-rate-limit", type=float, default=30, help="fake Bot API calls/s before 429s (0: unlimited)")
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="median seconds to the first Gemini chunk")
+    parser.add_argument("--gemini-sigma", type=float, default=0.5, help="log-normal spread of Gemini latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Gemini calls failing with 503")
+    parser.add_argument("--gemini-rpm", type=int, default=0, help="fake Gemini quota per model per minute (0: unlimited)")
+    parser.add_argument("--chunks", type=int, default=5, help="chunks per streamed reply")
+    parser.add_argument("--chunk-interval", type=float, default=0.2, help="seconds between streamed chunks")
+    parser.add_argument("--reply-chars", type=int, default=1500, help="length of each fake reply")
+    parser.add_argument("--no-flood-limits", action="store_true", help="disable the bot's outbound flood limits")
+    parser.add_argument("--bot-quotas", action="store_true", help="keep the bot's per-model rpm budgets")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure Python heap instead of RSS")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--port", type=int, default=0, help="port of the fake Bot API (default: any free port)")
+    args = parser.parse_args()
+
+    args.port = args.port or free_port()
+    configure_environment(args, args.port)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    results = asyncio.run(run(args))
+    print_report(args, results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
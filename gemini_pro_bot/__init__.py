@@ -0,0 +1,8 @@
+import time
+from dotenv import load_dotenv
+
+# Reference point of the start-up timing report
+STARTED_AT = time.perf_counter()
+
+# Load .env once for every module of the package
+load_dotenv()
@@ -0,0 +1,212 @@
+"""Run a JSONL file of prompts through the models, without Telegram.
+
+Each input line is a JSON object with a "prompt", and optionally an "id", a
+"model" overriding --model and "images", a list of image file paths:
+
+    {"id": "q1", "prompt": "Explain monads in one paragraph"}
+    {"id": "q2", "prompt": "What is in this picture?", "images": ["cat.jpg"]}
+
+Results are appended to the output file as they complete, one JSON object per
+line with the input line number, "id", "model", "response" (and "html" with
+--html) or "error", and "seconds". Prompts run concurrently within each
+model's requests-per-minute budget (see MODEL_RPM). Running the same command
+again after a crash or Ctrl-C skips the lines that already have a result.
+
+Usage:
+    python main.py batch prompts.jsonl -o results.jsonl
+    python main.py batch prompts.jsonl -o results.jsonl --model gemini-2.5-pro --concurrency 16
+    python main.py batch prompts.jsonl -o results.jsonl --retry-errors
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from google.api_core.exceptions import InternalServerError, ServiceUnavailable
+from gemini_pro_bot.executor import llm_executor
+from gemini_pro_bot.handlers import diagnose_empty_response, get_response_text
+from gemini_pro_bot.html_format import format_message
+from gemini_pro_bot.images import get_image_file_part, shutdown_image_pool
+from gemini_pro_bot.llm import DEFAULT_MODEL, get_model
+from gemini_pro_bot.quota import call_model
+
+# Prompts processed at the same time (bounded further by each model's rpm)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# Retries of a prompt that failed with a transient server error (500/503)
+BATCH_RETRIES = int(os.getenv("BATCH_RETRIES", "2"))
+# Seconds between two progress lines
+BATCH_PROGRESS_INTERVAL = float(os.getenv("BATCH_PROGRESS_INTERVAL", "10"))
+
+
+def load_completed(path: str, retry_errors: bool) -> set:
+    """Get the input line numbers that already have a result in `path`.
+
+    Lines cut off by a crash or that are not results are ignored. Failed prompts count as completed
+    unless `retry_errors` is set; the last result of a line wins.
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(record, dict) or "line" not in record:
+                continue
+            if retry_errors and "error" in record:
+                completed.discard(record["line"])
+            else:
+                completed.add(record["line"])
+    return completed
+
+
+def read_prompts(path: str, completed: set):
+    """Yield `(line number, record)` for every input line without a result yet."""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if number in completed or not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, {"error": f"Invalid JSON: {e}"}
+                continue
+            if isinstance(record, str):
+                record = {"prompt": record}
+            elif not isinstance(record, dict):
+                record = {"error": f"Expected a JSON object, got {type(record).__name__}"}
+            yield number, record
+
+
+class ResultWriter:
+    """Appends results to a JSONL file, one flushed line per result."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a+", encoding="utf-8")
+        # A crash may have left a partial last line; start on a fresh one
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell():
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+        self.written = 0
+        self.errors = 0
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.written += 1
+        if "error" in record:
+            self.errors += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+async def run_prompt(number: int, record: dict, default_model: str, html: bool) -> dict:
+    """Send one input record to its model and build its result record."""
+    model_id = record.get("model") or default_model
+    result = {"line": number, "id": record.get("id"), "model": model_id}
+    started = time.perf_counter()
+    try:
+        if "error" in record:
+            raise ValueError(record["error"])
+        if not record.get("prompt"):
+            raise ValueError('Missing "prompt"')
+        image_parts = await asyncio.gather(
+            *(get_image_file_part(path, model_id) for path in record.get("images") or ())
+        )
+        contents = [record["prompt"], *image_parts]
+        for attempt in range(BATCH_RETRIES + 1):
+            try:
+                # Waits for the model's rpm budget and retries 429s itself
+                response = await call_model(model_id, get_model(model_id).generate_content, contents)
+                break
+            except (ServiceUnavailable, InternalServerError):
+                if attempt >= BATCH_RETRIES:
+                    raise
+                await asyncio.sleep(random.uniform(0, 2**attempt))
+        text = get_response_text(response)
+        if not text:
+            raise ValueError(f"No text in response. {diagnose_empty_response(response)}")
+        result["response"] = text
+        if html:
+            result["html"] = format_message(text)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+async def report_progress(writer: ResultWriter, total: int, started: float) -> None:
+    while True:
+        await asyncio.sleep(BATCH_PROGRESS_INTERVAL)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{writer.written}/{total} done, {writer.errors} errors, "
+            f"{writer.written / elapsed:.2f} prompts/s"
+        )
+
+
+async def run_batch(args) -> None:
+    completed = load_completed(args.output, args.retry_errors)
+    with open(args.input, encoding="utf-8") as f:
+        total = sum(1 for n, line in enumerate(f, 1) if line.strip() and n not in completed)
+    if completed:
+        print(f"Resuming: {len(completed)} lines already done")
+    print(f"{total} prompts to run with concurrency {args.concurrency}")
+
+    # Calls run on the LLM executor, so it must not be the bottleneck
+    llm_executor.max_workers = max(llm_executor.max_workers, args.concurrency)
+    writer = ResultWriter(args.output)
+    # Bounded, so only a few input lines are read ahead of the workers
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    started = time.perf_counter()
+
+    async def produce() -> None:
+        for item in read_prompts(args.input, completed):
+            await queue.put(item)
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+    async def work() -> None:
+        while (item := await queue.get()) is not None:
+            writer.write(await run_prompt(*item, args.model, args.html))
+
+    progress = asyncio.create_task(report_progress(writer, total, started))
+    try:
+        await asyncio.gather(produce(), *(work() for _ in range(args.concurrency)))
+    finally:
+        progress.cancel()
+        writer.close()
+        llm_executor.shutdown(wait=False)
+        shutdown_image_pool()
+        elapsed = time.perf_counter() - started
+        print(
+            f"Wrote {writer.written} results ({writer.errors} errors) to {args.output} "
+            f"in {elapsed:.1f}s ({writer.written / elapsed if elapsed else 0:.2f} prompts/s)"
+        )
+
+
+def main(argv=None) -> None:
+    """Entry point of `python main.py batch`."""
+    parser = argparse.ArgumentParser(
+        prog="main.py batch", description=__doc__.splitlines()[0], epilog=__doc__.split("\n\n", 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help=f"model for lines without one (default: {DEFAULT_MODEL})")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="prompts processed at the same time")
+    parser.add_argument("--html", action="store_true", help="also store each response as Telegram HTML")
+    parser.add_argument("--retry-errors", action="store_true", help="run failed lines of a previous run again")
+    args = parser.parse_args(argv)
+    args.concurrency = max(1, args.concurrency)
+    try:
+        asyncio.run(run_batch(args))
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume")
@@ -1,34 +1,100 @@
+import asyncio
 import os
-from telegram import Update
 from telegram.ext import (
     CommandHandler,
+    InlineQueryHandler,
     MessageHandler,
     Application,
 )
-from gemini_pro_bot.filters import AuthFilter, MessageFilter, PhotoFilter
-from dotenv import load_dotenv
+from gemini_pro_bot.documents import close_download_client
+from gemini_pro_bot.filters import (
+    AuthFilter,
+    ChatFilter,
+    DocumentFilter,
+    MessageFilter,
+    PhotoFilter,
+)
 from gemini_pro_bot.handlers import (
     start,
     help_command,
     newchat_command,
     model_command,
+    hedge_command,
     handle_message,
     handle_image,
+    handle_document,
+    handle_inline_query,
+)
+from gemini_pro_bot.health import start_health_checker, stop_health_checker
+from gemini_pro_bot.lifecycle import mark_startup, run_polling, warm_up
+from gemini_pro_bot.outbound import outbound_scheduler
+from gemini_pro_bot.sessions import (
+    restore_chat,
+    start_session_writer,
+    stop_session_writer,
+)
+from gemini_pro_bot.webhook import (
+    UPDATE_QUEUE_SIZE,
+    run_webhook,
+    start_status_server,
+    stop_status_server,
 )
 
-load_dotenv()
+# "polling" (default) or "webhook" to receive updates through the embedded HTTP server
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+# Bot API endpoint, e.g. a self-hosted telegram-bot-api server or the load-test fake
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+TELEGRAM_BASE_FILE_URL = os.getenv("TELEGRAM_BASE_FILE_URL", "https://api.telegram.org/file/bot")
 
 
-def start_bot() -> None:
-    """Start the bot."""
+async def post_init(application: Application) -> None:
+    """Start background services once the Application is initialized."""
+    await warm_up(application)
+    await start_session_writer(application)
+    await start_health_checker(application)
+    if application.updater is not None:
+        # Webhook mode serves /metrics on its own server
+        await start_status_server(application)
+
+
+async def post_shutdown(application: Application) -> None:
+    """Stop background services and flush state on shutdown."""
+    await stop_status_server(application)
+    await stop_health_checker(application)
+    await stop_session_writer(application)
+    await close_download_client()
+
+
+def build_application(webhook: bool = False) -> Application:
+    """Create the Application and register all handlers."""
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(os.getenv("BOT_TOKEN")).build()
+    # Updates are processed concurrently; turns of the same chat are serialized in handlers.
+    builder = (
+        Application.builder()
+        .token(os.getenv("BOT_TOKEN"))
+        .base_url(TELEGRAM_BASE_URL)
+        .base_file_url(TELEGRAM_BASE_FILE_URL)
+        .concurrent_updates(True)
+        # All Bot API calls are queued within Telegram's flood limits
+        .rate_limiter(outbound_scheduler)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if webhook:
+        # Updates are pushed by the HTTP server into a bounded queue instead of polled
+        builder = builder.updater(None).update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+    application = builder.build()
+
+    # Restore persisted chat sessions before any other handler runs. Group messages
+    # that don't address the bot are filtered out first and never touch chat_data.
+    application.add_handler(MessageHandler(ChatFilter, restore_chat), group=-1)
 
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start, filters=AuthFilter))
     application.add_handler(CommandHandler("help", help_command, filters=AuthFilter))
     application.add_handler(CommandHandler("new", newchat_command, filters=AuthFilter))
     application.add_handler(CommandHandler("model", model_command, filters=AuthFilter))
+    application.add_handler(CommandHandler("hedge", hedge_command, filters=AuthFilter))
 
     # Any text message is sent to LLM to generate a response
     application.add_handler(MessageHandler(MessageFilter, handle_message))
@@ -36,5 +102,25 @@ def start_bot() -> None:
     # Any image is sent to LLM to generate a response
     application.add_handler(MessageHandler(PhotoFilter, handle_image))
 
-    # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Text files, PDFs and images sent as files are read and answered
+    application.add_handler(MessageHandler(DocumentFilter, handle_document))
+
+    # Inline queries (@bot question) are debounced and answered from a shared cache
+    application.add_handler(InlineQueryHandler(handle_inline_query))
+
+    return application
+
+
+def start_bot() -> None:
+    """Start the bot."""
+    mark_startup("imports")
+    if BOT_MODE == "webhook":
+        application = build_application(webhook=True)
+        mark_startup("build")
+        asyncio.run(run_webhook(application))
+        return
+
+    # Run the bot until the user presses Ctrl-C or the process is stopped
+    application = build_application()
+    mark_startup("build")
+    asyncio.run(run_polling(application))
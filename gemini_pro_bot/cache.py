@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from gemini_pro_bot.llm import GENERATION_CONFIG
+from gemini_pro_bot.metrics import register_gauge
+
+# Number of completed replies kept, and seconds a cached reply stays valid
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+
+
+def make_cache_key(model_id: str, prompt: str, history=(), images=()) -> str:
+    """Build a content-addressed cache key for a model request.
+
+    Args:
+        model_id (str): The model the request is sent to.
+        prompt (str): The user prompt.
+        history: The chat history sent along with the prompt (`glm.Content` list).
+        images: Raw bytes of the images sent along with the prompt.
+
+    Returns:
+        str: A hex digest identifying the request.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_id.encode())
+    digest.update(b"\0")
+    for content in history:
+        digest.update(type(content).serialize(content))
+    digest.update(b"\0")
+    digest.update(prompt.encode())
+    for image in images:
+        digest.update(b"\0")
+        digest.update(hashlib.sha256(image).digest())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of model replies with in-flight request deduplication.
+
+    Identical requests that arrive while one is already being generated wait for
+    that generation instead of calling the model again. Completed replies are only
+    reused later when `store` is enabled, since with sampling (temperature > 0)
+    the same prompt is expected to produce a different answer each time.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, store: bool):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store and maxsize > 0 and ttl > 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def _get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: str, value: str) -> None:
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        """Return the stored reply for `key` without generating it, or None."""
+        value = self._get(key) if self.store else None
+        if value is not None:
+            self.hits += 1
+        return value
+
+    async def get_or_compute(self, key: str, compute) -> tuple:
+        """Return the reply for `key`, generating it with `compute` if needed.
+
+        Args:
+            key (str): The request key from `make_cache_key`.
+            compute: Coroutine function generating the reply text.
+
+        Returns:
+            tuple[str, bool]: The reply text, and whether it came from the cache
+            or from another identical request rather than from `compute`.
+        """
+        value = self._get(key) if self.store else None
+        if value is not None:
+            self.hits += 1
+            return value, True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            value = await asyncio.shield(inflight)
+            if value:
+                self.coalesced += 1
+                return value, True
+            # The other request failed or produced nothing; try on our own
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight.setdefault(key, future)
+        try:
+            value = await compute()
+        except BaseException:
+            future.set_result(None)
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        future.set_result(value or None)
+        if value and self.store:
+            self._put(key, value)
+        return value, False
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the hit rate of the cache."""
+        total = self.hits + self.coalesced + self.misses
+        return {
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.coalesced) / total if total else 0.0,
+            "size": len(self._entries),
+            "inflight": len(self._inflight),
+            "store": self.store,
+        }
+
+
+# Only reuse completed replies when generation is deterministic
+response_cache = ResponseCache(
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    store=(GENERATION_CONFIG or {}).get("temperature") == 0,
+)
+register_gauge(
+    "gemini_bot_response_cache_hit_rate",
+    "Share of requests answered from the cache or an identical in-flight request.",
+    lambda: response_cache.stats()["hit_rate"],
+)
+
+
+def get_response_cache_stats() -> dict:
+    """Return the response cache's hit rate and counters."""
+    return response_cache.stats()
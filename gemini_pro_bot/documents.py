@@ -0,0 +1,252 @@
+import asyncio
+import codecs
+import itertools
+import mimetypes
+import mmap
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from urllib.parse import quote, urlsplit, urlunsplit
+from telegram import Document
+from gemini_pro_bot.history import get_history_policy
+
+# Largest document accepted, in bytes (the cloud Bot API serves files up to 20 MB)
+DOCUMENT_MAX_SIZE = int(os.getenv("DOCUMENT_MAX_SIZE", str(20 * 1024 * 1024)))
+# Directory documents are downloaded to (empty uses the system temp directory)
+DOCUMENT_TMP_DIR = os.getenv("DOCUMENT_TMP_DIR", "") or None
+# Most parts a long text file is split into; anything beyond is not read
+DOCUMENT_MAX_CHUNKS = int(os.getenv("DOCUMENT_MAX_CHUNKS", "16"))
+# Parts of a long text file summarized at the same time
+DOCUMENT_MAP_CONCURRENCY = int(os.getenv("DOCUMENT_MAP_CONCURRENCY", "2"))
+
+# Formats Gemini reads natively and that are sent as inline parts
+PDF_MIME_TYPE = "application/pdf"
+# Text formats that don't have a text/* MIME type
+_TEXT_MIME_TYPES = (
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/x-yaml",
+    "application/yaml",
+    "application/x-sh",
+    "application/sql",
+    "application/toml",
+    "application/x-python",
+)
+_TEXT_EXTENSIONS = (
+    ".txt", ".md", ".rst", ".log", ".csv", ".tsv", ".json", ".jsonl", ".xml", ".yaml",
+    ".yml", ".toml", ".ini", ".cfg", ".conf", ".env", ".sql", ".sh", ".py", ".js", ".ts",
+    ".jsx", ".tsx", ".java", ".kt", ".c", ".h", ".cpp", ".hpp", ".cs", ".go", ".rs", ".rb",
+    ".php", ".swift", ".html", ".css", ".scss", ".tex", ".srt", ".diff", ".patch",
+)
+# Bytes read per download write, and bytes inspected to tell text from binary
+_DOWNLOAD_CHUNK = 64 * 1024
+_SNIFF_SIZE = 4096
+# Share of the model's token budget left for the prompt and instructions
+_PROMPT_RESERVE = 0.1
+# Bytes per token used to size chunks (see history.estimate_text_tokens)
+_BYTES_PER_TOKEN = 4
+
+_client = None
+
+
+class DocumentError(ValueError):
+    """A document that can't be read. The message is meant for the user."""
+
+
+def get_document_kind(document: Document) -> str:
+    """Classify a Telegram document as "pdf", "image", "text" or None if unsupported.
+
+    Text files are recognized by their MIME type or file extension; files of
+    unknown type are sniffed after the download (see `looks_like_text`).
+    """
+    mime_type = document.mime_type or mimetypes.guess_type(document.file_name or "")[0] or ""
+    extension = os.path.splitext(document.file_name or "")[1].lower()
+    if mime_type == PDF_MIME_TYPE:
+        return "pdf"
+    if mime_type.startswith("image/"):
+        return "image"
+    if mime_type.startswith("text/") or mime_type in _TEXT_MIME_TYPES or extension in _TEXT_EXTENSIONS:
+        return "text"
+    if mime_type in ("", "application/octet-stream"):
+        return "unknown"
+    return None
+
+
+def too_large_message() -> str:
+    """Tell the user a document exceeds `DOCUMENT_MAX_SIZE`."""
+    return f"This file is too large. Files up to {DOCUMENT_MAX_SIZE // (1024 * 1024)} MB can be read."
+
+
+def looks_like_text(path: str) -> bool:
+    """Check whether the start of a file decodes as UTF-8 without NUL bytes."""
+    with open(path, "rb") as f:
+        head = f.read(_SNIFF_SIZE)
+    if b"\0" in head:
+        return False
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        # Not final: the sample may end inside a multi-byte character
+        decoder.decode(head, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _get_client():
+    import httpx
+
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30, read=60))
+    return _client
+
+
+async def close_download_client() -> None:
+    """Close the HTTP client used for document downloads."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _encode_url(file_path: str) -> str:
+    # Same quoting as telegram.File; the token in the path contains a colon
+    parts = urlsplit(file_path)
+    return urlunsplit((parts.scheme, parts.netloc, quote(parts.path), parts.query, parts.fragment))
+
+
+@asynccontextmanager
+async def downloaded(document: Document):
+    """Stream a document from Telegram into a temporary file.
+
+    The file is written in `_DOWNLOAD_CHUNK` pieces as it arrives, so memory
+    use does not depend on the size of the document. A local Bot API server
+    already has the file on disk; its path is used directly.
+
+    Yields:
+        str: Path of the downloaded file, removed when the context exits.
+
+    Raises:
+        DocumentError: If the document is larger than `DOCUMENT_MAX_SIZE`.
+    """
+    file = await document.get_file()
+    if os.path.isabs(file.file_path) and os.path.exists(file.file_path):
+        # telegram-bot-api running with --local
+        yield file.file_path
+        return
+
+    fd, path = tempfile.mkstemp(prefix="document-", dir=DOCUMENT_TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            size = 0
+            async with _get_client().stream("GET", _encode_url(file.file_path)) as response:
+                response.raise_for_status()
+                async for data in response.aiter_bytes(_DOWNLOAD_CHUNK):
+                    size += len(data)
+                    if size > DOCUMENT_MAX_SIZE:
+                        raise DocumentError(too_large_message())
+                    f.write(data)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def get_chunk_size(model_id: str) -> int:
+    """Get the number of bytes of text that fit into one request to a model."""
+    _, budget = get_history_policy(model_id)
+    return int(budget * (1 - _PROMPT_RESERVE)) * _BYTES_PER_TOKEN
+
+
+def _cut(window, start: int, end: int, size: int) -> int:
+    """Pick where a chunk ending at or before `end` should stop.
+
+    Prefers the last line break in the second half of the chunk, then falls back
+    to the start of the last UTF-8 character so no character is split.
+    """
+    if end >= size:
+        return size
+    newline = window.rfind(b"\n", start + (end - start) // 2, end)
+    if newline != -1:
+        return newline + 1
+    while end > start + 1 and window[end] & 0xC0 == 0x80:
+        end -= 1
+    return end
+
+
+def _chunk_bounds(window, size: int, chunk_size: int):
+    start = 0
+    while start < size:
+        end = _cut(window, start, min(start + chunk_size, size), size)
+        yield start, end
+        start = end
+
+
+def iter_text_chunks(path: str, chunk_size: int):
+    """Read a text file in chunks of at most `chunk_size` bytes.
+
+    Files that fit into one chunk are read at once; larger files are memory
+    mapped and sliced, so only the chunk being decoded is held in memory.
+    Chunks end at line breaks where possible and never split a character.
+
+    Yields:
+        str: Consecutive chunks of the file, decoded as UTF-8.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if size <= chunk_size:
+            yield f.read().decode("utf-8", errors="replace")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as window:
+            for start, end in _chunk_bounds(window, size, chunk_size):
+                yield window[start:end].decode("utf-8", errors="replace")
+
+
+def count_text_chunks(path: str, chunk_size: int) -> int:
+    """Count the chunks `iter_text_chunks` yields for a file, without decoding them."""
+    size = os.path.getsize(path)
+    if size <= chunk_size:
+        return 1
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as window:
+        return sum(1 for _ in _chunk_bounds(window, size, chunk_size))
+
+
+def read_binary_part(path: str, mime_type: str) -> dict:
+    """Read a file as an inline part (e.g. a PDF) for `generate_content`."""
+    with open(path, "rb") as f:
+        return {"mime_type": mime_type, "data": f.read()}
+
+
+async def map_chunks(chunks, summarize, on_progress=None) -> list:
+    """Summarize chunks of a document, `DOCUMENT_MAP_CONCURRENCY` at a time.
+
+    Chunks are pulled from the iterator only when a slot is free, so at most
+    `DOCUMENT_MAP_CONCURRENCY` of them are in memory at any time.
+
+    Args:
+        chunks: Iterator of text chunks, e.g. from `iter_text_chunks`.
+        summarize: Coroutine function taking `(index, text)` and returning notes.
+        on_progress: Optional coroutine function called with the number of
+            chunks done so far.
+
+    Returns:
+        list: The notes of each chunk, in the order of the chunks.
+    """
+    chunks = enumerate(itertools.islice(chunks, DOCUMENT_MAX_CHUNKS))
+    notes = {}
+
+    async def worker() -> None:
+        # Chunks are handed out synchronously, so workers never get the same one
+        for index, text in chunks:
+            notes[index] = await summarize(index, text)
+            del text
+            if on_progress is not None:
+                await on_progress(len(notes))
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(1, DOCUMENT_MAP_CONCURRENCY))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    return [notes[i] for i in sorted(notes)]
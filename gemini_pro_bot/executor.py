@@ -0,0 +1,152 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gemini_pro_bot.metrics import observe_stage, register_gauge
+
+# Number of worker threads reserved for blocking Gemini SDK calls
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "8"))
+# Seconds a single Gemini call (or streamed chunk) may take, including queue wait
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+
+class NoOutputError(RuntimeError):
+    """A model call ended without producing any output (e.g. an empty stream)."""
+
+
+class LLMExecutor:
+    """A bounded, named thread pool dedicated to blocking Gemini SDK calls.
+
+    Keeping model calls off the event loop's default executor means slow
+    generations can't starve other `asyncio.to_thread` users, and the pool
+    tracks how many calls are waiting and how long they waited.
+    """
+
+    def __init__(self, max_workers: int, timeout: float):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._last_wait = 0.0
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="gemini-llm"
+                )
+            return self._pool
+
+    def _on_done(self, future) -> None:
+        if future.cancelled():
+            # Cancelled before a worker picked it up, so it never left the queue
+            with self._lock:
+                self._queued -= 1
+
+    async def run(self, func, *args, timeout: float = None, **kwargs):
+        """Run `func(*args, **kwargs)` in the pool and await its result.
+
+        Args:
+            func: The blocking callable to run.
+            timeout (float): Seconds to wait before giving up. Defaults to `LLM_TIMEOUT`.
+
+        Returns:
+            The return value of `func`.
+
+        Raises:
+            NoOutputError: If `func` raised StopIteration, which can't be
+                passed through an asyncio future.
+            asyncio.TimeoutError: If the call did not finish in time. A call that
+                had not started yet is cancelled and never runs; a running call
+                is left to finish in its thread and its result is discarded.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        submitted = time.monotonic()
+        waits = []
+
+        def call():
+            wait = time.monotonic() - submitted
+            waits.append(wait)
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._total_wait += wait
+                self._last_wait = wait
+                self._max_wait = max(self._max_wait, wait)
+            try:
+                return func(*args, **kwargs)
+            except StopIteration as e:
+                # e.g. the SDK reading the first chunk of an empty stream
+                raise NoOutputError("The model returned no output") from e
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        pool = self._get_pool()
+        with self._lock:
+            self._queued += 1
+        future = pool.submit(call)
+        future.add_done_callback(self._on_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise
+        finally:
+            if waits:
+                observe_stage("executor_wait", waits[0])
+
+    def stats(self) -> dict:
+        """Return queue depth, in-flight calls and queue wait times."""
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "max_workers": self.max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "timeouts": self._timeouts,
+                "last_wait": self._last_wait,
+                "max_wait": self._max_wait,
+                "avg_wait": self._total_wait / started if started else 0.0,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting calls and release the worker threads."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+llm_executor = LLMExecutor(LLM_MAX_WORKERS, LLM_TIMEOUT)
+register_gauge(
+    "gemini_bot_llm_queue_depth",
+    "Gemini calls waiting for an LLM executor worker.",
+    lambda: llm_executor.stats()["queued"],
+)
+register_gauge(
+    "gemini_bot_llm_running",
+    "Gemini calls currently running on the LLM executor.",
+    lambda: llm_executor.stats()["running"],
+)
+
+
+async def run_llm(func, *args, timeout: float = None, **kwargs):
+    """Run a blocking Gemini SDK call on the dedicated LLM executor."""
+    return await llm_executor.run(func, *args, timeout=timeout, **kwargs)
+
+
+def get_llm_executor_stats() -> dict:
+    """Return the dedicated LLM executor's queue and wait-time statistics."""
+    return llm_executor.stats()
@@ -1,25 +1,167 @@
 import os
-from telegram import Update
-from telegram.ext.filters import UpdateFilter, COMMAND, TEXT, PHOTO
-from dotenv import load_dotenv
+import time
+from collections import OrderedDict
+from telegram import Message, MessageEntity, Update
+from telegram.constants import ChatType
+from telegram.ext import filters as tg_filters
+from telegram.ext.filters import UpdateFilter, COMMAND, TEXT, PHOTO, Document
+from gemini_pro_bot.turns import MEDIA_GROUP_MAX_WAIT
 
-load_dotenv()
+# Optional file with one username or user ID per line, merged with AUTHORIZED_USERS.
+# Edits are picked up within AUTHORIZED_USERS_RELOAD_INTERVAL seconds, without a restart.
+AUTHORIZED_USERS_FILE = os.getenv("AUTHORIZED_USERS_FILE", "")
+AUTHORIZED_USERS_RELOAD_INTERVAL = float(os.getenv("AUTHORIZED_USERS_RELOAD_INTERVAL", "10"))
+# Comma-separated prefixes that address the bot in groups (e.g. "!ask"), besides
+# mentioning it or replying to it. Other group messages are ignored.
+GROUP_TRIGGER_PREFIXES = tuple(
+    p.strip().lower() for p in os.getenv("GROUP_TRIGGER_PREFIXES", "").split(",") if p.strip()
+)
 
-_AUTHORIZED_USERS = [
-    i.strip() for i in os.getenv("AUTHORIZED_USERS", "").split(",") if i.strip()
-]
+_authorized_users = frozenset()
+_users_file_mtime = None
+_next_reload_check = 0.0
+# media_group_id -> expiry of group albums one of whose photos addressed the bot
+_triggered_albums = OrderedDict()
+
+
+def _parse_users(entries) -> set:
+    # Usernames are case-insensitive and may be written with or without "@"
+    return {e.strip().lstrip("@").lower() for e in entries if e.strip()}
+
+
+def reload_authorized_users() -> None:
+    """Rebuild the set of authorized users from AUTHORIZED_USERS and AUTHORIZED_USERS_FILE."""
+    global _authorized_users, _users_file_mtime
+    users = _parse_users(os.getenv("AUTHORIZED_USERS", "").split(","))
+    if AUTHORIZED_USERS_FILE:
+        try:
+            _users_file_mtime = os.stat(AUTHORIZED_USERS_FILE).st_mtime
+            with open(AUTHORIZED_USERS_FILE, encoding="utf-8") as f:
+                users |= _parse_users(line.split("#", 1)[0] for line in f)
+        except OSError as e:
+            print("Failed to read AUTHORIZED_USERS_FILE:", e)
+    # Swapped in one assignment, so concurrent lookups see the old or the new set
+    _authorized_users = frozenset(users)
+
+
+def get_authorized_users() -> frozenset:
+    """Get the authorized users, reloading them if AUTHORIZED_USERS_FILE changed."""
+    global _next_reload_check
+    if AUTHORIZED_USERS_FILE:
+        now = time.monotonic()
+        if now >= _next_reload_check:
+            _next_reload_check = now + AUTHORIZED_USERS_RELOAD_INTERVAL
+            try:
+                changed = os.stat(AUTHORIZED_USERS_FILE).st_mtime != _users_file_mtime
+            except OSError:
+                changed = _users_file_mtime is not None
+            if changed:
+                reload_authorized_users()
+                print(f"Reloaded {len(_authorized_users)} authorized users")
+    return _authorized_users
+
+
+reload_authorized_users()
 
 
 class AuthorizedUserFilter(UpdateFilter):
+    """Allows updates from authorized users, or from everyone if none are configured."""
+
     def filter(self, update: Update):
-        if not _AUTHORIZED_USERS:
+        users = get_authorized_users()
+        if not users:
             return True
-        return (
-            update.message.from_user.username in _AUTHORIZED_USERS
-            or str(update.message.from_user.id) in _AUTHORIZED_USERS
+        # effective_user also covers inline queries, which have no message
+        user = update.effective_user
+        if user is None:
+            return False
+        return str(user.id) in users or (
+            user.username is not None and user.username.lower() in users
         )
 
 
+def _is_bot_mention(message: Message, entity: MessageEntity, username: str) -> bool:
+    if entity.type == MessageEntity.TEXT_MENTION:
+        return entity.user is not None and entity.user.id == message.get_bot().id
+    if entity.type != MessageEntity.MENTION:
+        return False
+    if message.text is not None:
+        mention = message.parse_entity(entity)
+    else:
+        mention = message.parse_caption_entity(entity)
+    return mention[1:].lower() == username
+
+
+def _is_triggered_album(media_group_id: str) -> bool:
+    now = time.monotonic()
+    while _triggered_albums and next(iter(_triggered_albums.values())) < now:
+        _triggered_albums.popitem(last=False)
+    return media_group_id in _triggered_albums
+
+
+class GroupTriggerFilter(tg_filters.MessageFilter):
+    """Lets through private messages, and group messages that address the bot.
+
+    A group message addresses the bot when it mentions the bot, replies to one
+    of its messages or starts with one of `GROUP_TRIGGER_PREFIXES`. Only fields
+    of the message itself are inspected, so ignored messages cost no chat data
+    lookups or model calls. In an album only the captioned photo carries the
+    mention, so the photos that follow it in the same album are let through too.
+    """
+
+    def filter(self, message: Message) -> bool:
+        if message.chat.type == ChatType.PRIVATE:
+            return True
+        album = message.media_group_id
+        if album is not None and _is_triggered_album(album):
+            return True
+        triggered = self._addresses_bot(message)
+        if triggered and album is not None:
+            _triggered_albums[album] = time.monotonic() + MEDIA_GROUP_MAX_WAIT
+        return triggered
+
+    @staticmethod
+    def _addresses_bot(message: Message) -> bool:
+        text = message.text or message.caption or ""
+        if GROUP_TRIGGER_PREFIXES and text.lstrip().lower().startswith(GROUP_TRIGGER_PREFIXES):
+            return True
+        bot = message.get_bot()
+        reply = message.reply_to_message
+        if reply is not None and reply.from_user is not None and reply.from_user.id == bot.id:
+            return True
+        username = (bot.username or "").lower()
+        entities = message.entities or message.caption_entities
+        return any(_is_bot_mention(message, e, username) for e in entities)
+
+
+def get_prompt_text(message: Message) -> str:
+    """Get the text or caption of a message without the trigger that addressed the bot.
+
+    A leading `GROUP_TRIGGER_PREFIXES` prefix and mentions of the bot are removed,
+    so "@bot 2" selects a model and "!ask what is Rust?" asks "what is Rust?".
+    """
+    text = message.text if message.text is not None else message.caption or ""
+    entities = message.entities if message.text is not None else message.caption_entities
+    username = (message.get_bot().username or "").lower()
+    # Remove mentions back to front so earlier UTF-16 offsets stay valid
+    encoded = text.encode("utf-16-le")
+    for entity in sorted(entities, key=lambda e: e.offset, reverse=True):
+        if _is_bot_mention(message, entity, username):
+            start, end = entity.offset * 2, (entity.offset + entity.length) * 2
+            encoded = encoded[:start] + encoded[end:]
+    text = encoded.decode("utf-16-le").strip()
+    for prefix in GROUP_TRIGGER_PREFIXES:
+        if text.lower().startswith(prefix):
+            return text[len(prefix):].strip()
+    return text
+
+
 AuthFilter = AuthorizedUserFilter()
-MessageFilter = AuthFilter & ~COMMAND & TEXT
-PhotoFilter = AuthFilter & ~COMMAND & PHOTO
+TriggerFilter = GroupTriggerFilter()
+# Updates worth loading a chat's session for: commands and messages addressed to the
+# bot by authorized users
+ChatFilter = AuthFilter & (COMMAND | TriggerFilter)
+# Cheapest checks first: filters stop at the first one that fails
+MessageFilter = AuthFilter & ~COMMAND & TEXT & TriggerFilter
+PhotoFilter = AuthFilter & ~COMMAND & PHOTO & TriggerFilter
+DocumentFilter = AuthFilter & ~COMMAND & Document.ALL & TriggerFilter
@@ -1,4 +1,6 @@
 import asyncio
+import html
+from contextlib import closing
 from gemini_pro_bot.llm import (
     get_model, 
     get_model_list_text, 
@@ -6,19 +8,155 @@ from gemini_pro_bot.llm import (
     DEFAULT_MODEL,
     get_model_name_by_id
 )
-from google.generativeai.types.generation_types import (
-    StopCandidateException,
-    BlockedPromptException,
-)
-from telegram import Update
+from telegram import InlineQuery, InlineQueryResultArticle, InputTextMessageContent, Message, Update
 from telegram.ext import (
     ContextTypes,
 )
 from telegram.error import NetworkError, BadRequest
-from telegram.constants import ChatAction, ParseMode
-from gemini_pro_bot.html_format import format_message
-import PIL.Image as load_image
-from io import BytesIO
+from google.api_core.exceptions import TooManyRequests
+from telegram.constants import ParseMode
+from gemini_pro_bot.html_format import format_message, split_message
+from gemini_pro_bot.cache import make_cache_key, response_cache
+from gemini_pro_bot.documents import (
+    DOCUMENT_MAX_CHUNKS,
+    DOCUMENT_MAX_SIZE,
+    PDF_MIME_TYPE,
+    DocumentError,
+    count_text_chunks,
+    downloaded,
+    get_chunk_size,
+    get_document_kind,
+    iter_text_chunks,
+    looks_like_text,
+    map_chunks,
+    read_binary_part,
+    too_large_message,
+)
+from gemini_pro_bot.history import IMAGE_TOKENS, estimate_text_tokens, trim_history
+from gemini_pro_bot.filters import AuthFilter, get_prompt_text
+from gemini_pro_bot.health import call_with_fallback
+from gemini_pro_bot.executor import NoOutputError
+from gemini_pro_bot.hedging import HEDGE_MODEL, hedged_call, is_hedging_enabled
+from gemini_pro_bot.inline import (
+    INLINE_CACHE_TIME,
+    INLINE_MIN_LENGTH,
+    INLINE_MODEL,
+    INLINE_QUERIES,
+    INLINE_TIMEOUT,
+    debounce,
+    get_cached_answer,
+    get_description,
+    get_inline_cache_key,
+    inline_cache,
+    normalize_query,
+)
+from gemini_pro_bot.images import get_image_file_part, get_image_part
+from gemini_pro_bot.lifecycle import drainable
+from gemini_pro_bot.metrics import record_error, record_tokens, request_trace, stage
+from gemini_pro_bot.placeholder import Placeholder
+from gemini_pro_bot.quota import call_model
+from gemini_pro_bot.sessions import mark_history_changed
+from gemini_pro_bot.streaming import STREAM_RESPONSES, stream_response
+from gemini_pro_bot.turns import chat_turn, collect_media_group
+
+
+def queued_status(init_msg: Placeholder):
+    """Build an `on_queued` callback that shows the queue position in `init_msg`."""
+
+    async def on_queued(position: int) -> None:
+        try:
+            await init_msg.edit_text(f"Queued (position {position}), waiting for model quota...")
+        except BadRequest:
+            pass
+
+    return on_queued
+
+
+async def send_formatted_reply(init_msg: Placeholder, text: str) -> None:
+    """Format a model reply and deliver it, splitting it if it is too long.
+
+    The first chunk replaces the placeholder in `init_msg`; the remaining chunks are
+    sent as follow-up messages in order while the placeholder edit is in flight.
+    If no placeholder was sent yet, the first chunk is sent before the follow-ups
+    so the reply stays in order. A follow-up Telegram rejects is skipped rather
+    than failing the reply, whose first chunk may already be delivered.
+    """
+    with stage("format"):
+        chunks = split_message(format_message(text))
+
+    async def send_follow_ups() -> None:
+        for chunk in chunks[1:]:
+            try:
+                await init_msg.chat.send_message(
+                    text=chunk,
+                    parse_mode=ParseMode.HTML,
+                    disable_web_page_preview=True,
+                )
+            except BadRequest as e:
+                record_error("FollowUp")
+                print("Failed to send part of a reply:", e)
+
+    first = init_msg.edit_text(
+        text=chunks[0],
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+    )
+    with stage("final_edit"):
+        if init_msg.has_message:
+            await asyncio.gather(first, send_follow_ups())
+        else:
+            await first
+            await send_follow_ups()
+
+
+def get_response_text(response) -> str:
+    """Concatenate the text parts of the first candidate of a model response."""
+    full_plain_message = ""
+    if hasattr(response, "candidates") and response.candidates:
+        candidate = response.candidates[0]
+        if getattr(candidate, "content", None) and getattr(candidate.content, "parts", None):
+            for part in candidate.content.parts:
+                txt = getattr(part, "text", None)
+                if txt:
+                    full_plain_message += txt
+    return full_plain_message
+
+
+def diagnose_empty_response(response) -> str:
+    """Explain why a model response contains no text (safety filter, finish reason...)."""
+    reasons = []
+    candidate = None
+    if hasattr(response, "candidates") and response.candidates:
+        candidate = response.candidates[0]
+    if candidate:
+        # Safety ratings
+        safety_ratings = getattr(candidate, "safety_ratings", []) or []
+        blocked_categories = []
+        for r in safety_ratings:
+            prob = getattr(r, "probability", None)
+            cat = getattr(r, "category", None)
+            prob_name = getattr(prob, "name", None)
+            cat_name = getattr(cat, "name", None)
+            if prob_name in ("MEDIUM", "HIGH"):
+                blocked_categories.append(cat_name or "UNKNOWN")
+        if blocked_categories:
+            reasons.append("Safety filter triggered: " + ", ".join(blocked_categories))
+        finish_reason = getattr(candidate, "finish_reason", None)
+        finish_name = getattr(finish_reason, "name", None)
+        if finish_name:
+            reasons.append(f"Finish reason: {finish_name}")
+    else:
+        reasons.append("No candidates returned (model may be unavailable or ID invalid)")
+    return "; ".join(reasons) if reasons else "Unknown reason"
+
+
+def append_turn(chat, prompt: str, reply: str) -> None:
+    """Record a prompt/reply pair in a chat session without calling the model."""
+    chat.history = [
+        *chat.history,
+        {"role": "user", "parts": [{"text": prompt}]},
+        {"role": "model", "parts": [{"text": reply}]},
+    ]
 
 
 def new_chat(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -26,6 +164,7 @@ def new_chat(context: ContextTypes.DEFAULT_TYPE) -> None:
     selected_model = context.chat_data.get("selected_model", DEFAULT_MODEL)
     model = get_model(selected_model)
     context.chat_data["chat"] = model.start_chat()
+    mark_history_changed(context.chat_data)
 
 
 async def start(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
@@ -47,6 +186,10 @@ Basic commands:
 Chat commands:
 /new - Start a new chat session (model will forget previously generated messages)
 /model - Show available models and current selection
+/hedge - Toggle hedging: if the model is slow, race a faster model and use whichever answers first
+
+Files:
+Send a text file, source file, log, PDF or image as a document, with your question as the caption. Long text files are read part by part and summarized.
 
 Model Selection:
 Send a number (1-4) to select a model:
@@ -73,6 +216,20 @@ async def newchat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await init_msg.edit_text(f"New chat session started with {model_name}.")
 
 
+async def hedge_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Toggle hedged requests for this chat."""
+    enabled = not is_hedging_enabled(context.chat_data)
+    context.chat_data["hedge"] = enabled
+    if enabled:
+        text = (
+            f"Hedging enabled. Slow answers will be raced against {get_model_name_by_id(HEDGE_MODEL)}, "
+            "and whichever model answers first is used."
+        )
+    else:
+        text = "Hedging disabled. Answers always come from the selected model."
+    await update.message.reply_text(text)
+
+
 async def model_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show available models and current selection."""
     selected_model = context.chat_data.get("selected_model", DEFAULT_MODEL)
@@ -90,7 +247,7 @@ async def model_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def handle_model_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle model selection when user sends a number 1-5."""
-    text = update.message.text.strip()
+    text = get_prompt_text(update.message)
     
     if text in AVAILABLE_MODELS:
         # Valid model selection
@@ -112,192 +269,535 @@ async def handle_model_selection(update: Update, context: ContextTypes.DEFAULT_T
 
 
 # Define the function that will handle incoming messages
+@drainable
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles incoming text messages from users.
 
     First checks if the message is a model selection (1-5).
-    If not, checks if a chat session exists for the user, initializes a new session if not.
-    Sends the user's message to the chat session to generate a response.
-    Streams the response back to the user, handling any errors.
+    If not, queues the message as a turn for this chat. Turns are serialized per chat,
+    and messages that arrive while a turn is pending are merged into a single prompt.
     """
     # Check if this is a model selection
     if await handle_model_selection(update, context):
         return
-    
+
+    async with chat_turn(context.chat_data, update.message) as messages:
+        if not messages:
+            # Merged into a turn collected by another update
+            return
+        # In groups, without the mention or prefix that addressed the bot
+        text = "\n".join(filter(None, (get_prompt_text(m) for m in messages)))
+        if not text:
+            await messages[-1].reply_text("What would you like to ask?")
+            return
+        selected_model = context.chat_data.get("selected_model", DEFAULT_MODEL)
+        with request_trace("text", selected_model):
+            # Typing action and placeholder are handled alongside the model call
+            async with Placeholder(messages[-1]) as init_msg:
+                await generate_text_reply(messages[-1], context, text, init_msg)
+
+
+async def generate_text_reply(
+    message: Message, context: ContextTypes.DEFAULT_TYPE, text: str, init_msg: Placeholder
+) -> None:
+    """Sends a prompt to the chat session and replies to `message` with the result.
+
+    Checks if a chat session exists for the user, initializes a new session if not.
+    Sends the prompt to the chat session to generate a response.
+    Streams the response back to the user through `init_msg`, handling any errors.
+    """
+    from google.generativeai.types.generation_types import (
+        StopCandidateException,
+        BlockedPromptException,
+    )
+
     if context.chat_data.get("chat") is None:
         new_chat(context)
-    text = update.message.text
-    init_msg = await update.message.reply_text(
-        text="Generating...", reply_to_message_id=update.message.message_id
-    )
-    await update.message.chat.send_action(ChatAction.TYPING)
     # Generate a response using the text-generation pipeline
     chat = context.chat_data.get("chat")  # Get the chat session for this chat
+    selected_model = context.chat_data.get("selected_model", DEFAULT_MODEL)
+    on_queued = queued_status(init_msg)
+    # Keep the resent history within the model's turn and token budget
+    history_length = len(chat.history)
+    context.chat_data["history_tokens"] = trim_history(chat, selected_model, text)
+    if len(chat.history) != history_length:
+        mark_history_changed(context.chat_data)
     response = None
+    # Tokens are charged to the model that answered, which differs after a fallback
+    answered_by = selected_model
+
+    hedge = is_hedging_enabled(context.chat_data)
+
+    async def start_call(model_id: str):
+        # Each call runs on a copy of the chat, so a failed, fallback or
+        # hedged call never leaves a broken turn behind in the user's session
+        session = get_model(model_id).start_chat(history=chat.history)
+        # Use synchronous API on the LLM executor within the model's quota;
+        # a streamed response is returned as soon as its first chunk arrived
+        return session, await call_model(
+            model_id, session.send_message, text, stream=STREAM_RESPONSES, on_queued=on_queued
+        )
+
+    async def attempt(model_id: str):
+        nonlocal response
+        _, (session, response) = await hedged_call(model_id, start_call, hedge)
+        if STREAM_RESPONSES:
+            # Stream chunks into init_msg
+            await stream_response(response, init_msg)
+        return session, get_response_text(response)
+
+    async def generate() -> str:
+        nonlocal answered_by
+        with stage("gemini"):
+            model_id, (session, reply) = await call_with_fallback(selected_model, attempt)
+        answered_by = model_id
+        if model_id != selected_model:
+            print(f"{selected_model} is unavailable, answered with {model_id}")
+        chat.history = session.history
+        mark_history_changed(context.chat_data)
+        return reply
+
     try:
-        # Use synchronous API in a thread; omit stream kw if unsupported
-        response = await asyncio.to_thread(chat.send_message, text)
-    except StopIteration:
+        cache_key = make_cache_key(selected_model, text, history=chat.history)
+        full_plain_message, cached = await response_cache.get_or_compute(cache_key, generate)
+    except asyncio.TimeoutError:
+        record_error("Timeout")
+        await init_msg.edit_text("The model took too long to respond. Please try again.")
+        return
+    except TooManyRequests as tmr:
+        record_error("QuotaExhausted")
+        print("Quota exhausted for", selected_model, tmr)
+        await init_msg.edit_text("The model is over its rate limit right now. Please try again in a minute.")
+        return
+    except NoOutputError:
+        record_error("NoOutput")
         await init_msg.edit_text(
             "Selected model returned no output (possibly unavailable). Choose another model with /model."
         )
         return
     except StopCandidateException as sce:
-        print("Prompt: ", text, " was stopped. User: ", update.message.from_user)
+        record_error("StopCandidate")
+        print("Prompt: ", text, " was stopped. User: ", message.from_user)
         print(sce)
         await init_msg.edit_text("The model unexpectedly stopped generating.")
-        chat.rewind()  # Rewind the chat session to prevent the bot from getting stuck
         return
     except BlockedPromptException as bpe:
-        print("Prompt: ", text, " was blocked. User: ", update.message.from_user)
+        record_error("BlockedPrompt")
+        print("Prompt: ", text, " was blocked. User: ", message.from_user)
         print(bpe)
         await init_msg.edit_text("Blocked due to safety concerns.")
-        if response:
-            # Resolve the response to prevent the chat session from getting stuck
-            await response.resolve()
         return
-    full_plain_message = ""
     try:
+        if full_plain_message:
+            if cached:
+                # The reply was generated for an identical request; record the turn here too
+                append_turn(chat, text, full_plain_message)
+                mark_history_changed(context.chat_data)
+            else:
+                record_tokens(
+                    answered_by,
+                    context.chat_data["history_tokens"],
+                    estimate_text_tokens(full_plain_message),
+                )
+            await send_formatted_reply(init_msg, full_plain_message)
+            return
+
         # Non-streaming handling with robust safety / empty candidate diagnostics
+        record_error("EmptyCandidates")
         if not response:
             await init_msg.edit_text("No response object returned from model.")
             return
-
-        candidate = None
-        if hasattr(response, "candidates") and response.candidates:
-            candidate = response.candidates[0]
-            if getattr(candidate, "content", None) and getattr(candidate.content, "parts", None):
-                for part in candidate.content.parts:
-                    txt = getattr(part, "text", None)
-                    if txt:
-                        full_plain_message += txt
-
-        # If still empty, do nothing and proceed to diagnostics
-        if not full_plain_message:
-            pass
-
-        if full_plain_message:
-            message = format_message(full_plain_message)
-            await init_msg.edit_text(
-                text=message,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True,
-            )
-            return
-
-        # Diagnose why empty
-        reasons = []
-        if candidate:
-            # Safety ratings
-            safety_ratings = getattr(candidate, "safety_ratings", []) or []
-            blocked_categories = []
-            for r in safety_ratings:
-                prob = getattr(r, "probability", None)
-                cat = getattr(r, "category", None)
-                prob_name = getattr(prob, "name", None)
-                cat_name = getattr(cat, "name", None)
-                if prob_name in ("MEDIUM", "HIGH"):
-                    blocked_categories.append(cat_name or "UNKNOWN")
-            if blocked_categories:
-                reasons.append("Safety filter triggered: " + ", ".join(blocked_categories))
-            finish_reason = getattr(candidate, "finish_reason", None)
-            finish_name = getattr(finish_reason, "name", None)
-            if finish_name:
-                reasons.append(f"Finish reason: {finish_name}")
-        else:
-            reasons.append("No candidates returned (model may be unavailable or ID invalid)")
-
-        diagnostic = "; ".join(reasons) if reasons else "Unknown reason"
+        diagnostic = diagnose_empty_response(response)
         await init_msg.edit_text(
             f"Model produced no text. {diagnostic}. Try another model (/model) or rephrase."
         )
     except Exception as e:
+        record_error("PostProcessing")
         print("Post-processing error:", e)
         await init_msg.edit_text("Error processing model response.")
 
 
+@drainable
 async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle incoming images with captions and generate a response."""
-    init_msg = await update.message.reply_text(
-        text="Generating...", reply_to_message_id=update.message.message_id
-    )
-    
+    """Handle incoming images with captions and generate a response.
+
+    Photos sent as an album are collected first and answered with a single
+    request containing every image of the album.
+    """
+    messages = [update.message]
+    if update.message.media_group_id:
+        messages = await collect_media_group(context.chat_data, update.message)
+        if not messages:
+            # Part of an album collected by another update
+            return
+    selected_model = context.chat_data.get("selected_model", DEFAULT_MODEL)
+    with request_trace("image", selected_model):
+        async with Placeholder(messages[0]) as init_msg:
+            await generate_image_reply(messages, context, init_msg)
+
+
+async def generate_image_reply(
+    messages: list, context: ContextTypes.DEFAULT_TYPE, init_msg: Placeholder
+) -> None:
+    """Sends one or more photos with their caption to the model and replies through `init_msg`."""
     # Get the selected model for this chat
     selected_model = context.chat_data.get("selected_model", DEFAULT_MODEL)
-    img_model = get_model(selected_model)
-    
-    images = update.message.photo
-    unique_images: dict = {}
-    for img in images:
-        file_id = img.file_id[:-7]
-        if file_id not in unique_images:
-            unique_images[file_id] = img
-        elif img.file_size > unique_images[file_id].file_size:
-            unique_images[file_id] = img
-    file_list = list(unique_images.values())
-    file = await file_list[0].get_file()
-    a_img = load_image.open(BytesIO(await file.download_as_bytearray()))
+
+    with stage("image_prepare"):
+        image_parts = await asyncio.gather(
+            *(get_image_part(m.photo, selected_model) for m in messages)
+        )
     prompt = None
-    if update.message.caption:
-        prompt = update.message.caption
+    caption = next((get_prompt_text(m) for m in messages if m.caption), None)
+    if caption:
+        prompt = caption
+    elif len(image_parts) > 1:
+        prompt = "Analyse these images and generate response"
     else:
         prompt = "Analyse this image and generate response"
+    response = None
+    # Tokens are charged to the model that answered, which differs after a fallback
+    answered_by = selected_model
+
+    on_queued = queued_status(init_msg)
+
+    hedge = is_hedging_enabled(context.chat_data)
+
+    async def start_call(model_id: str):
+        return await call_model(
+            model_id,
+            get_model(model_id).generate_content,
+            [prompt, *image_parts],
+            stream=STREAM_RESPONSES,
+            on_queued=on_queued,
+        )
+
+    async def attempt(model_id: str) -> str:
+        nonlocal response
+        _, response = await hedged_call(model_id, start_call, hedge)
+        if STREAM_RESPONSES:
+            await stream_response(response, init_msg)
+        return get_response_text(response)
+
+    async def generate() -> str:
+        nonlocal answered_by
+        with stage("gemini"):
+            model_id, reply = await call_with_fallback(selected_model, attempt)
+        answered_by = model_id
+        if model_id != selected_model:
+            print(f"{selected_model} is unavailable, answered with {model_id}")
+        return reply
+
     try:
-        response = await asyncio.to_thread(img_model.generate_content, [prompt, a_img])
-    except StopIteration:
+        cache_key = make_cache_key(
+            selected_model, prompt, images=[part["data"] for part in image_parts]
+        )
+        full_plain_message, cached = await response_cache.get_or_compute(cache_key, generate)
+    except asyncio.TimeoutError:
+        record_error("Timeout")
+        await init_msg.edit_text("The image model took too long to respond. Please try again.")
+        return
+    except TooManyRequests as tmr:
+        record_error("QuotaExhausted")
+        print("Quota exhausted for", selected_model, tmr)
+        await init_msg.edit_text("The image model is over its rate limit right now. Please try again in a minute.")
+        return
+    except NoOutputError:
+        record_error("NoOutput")
         await init_msg.edit_text(
             "Image request produced no output (model unavailable). Try another model with /model."
         )
         return
     except Exception as e:
+        record_error(type(e).__name__)
         print("Image generation call failed:", e)
         await init_msg.edit_text("Error calling image model.")
         return
 
-    full_plain_message = ""
     try:
-        candidate = None
-        if hasattr(response, "candidates") and response.candidates:
-            candidate = response.candidates[0]
-            if getattr(candidate, "content", None) and getattr(candidate.content, "parts", None):
-                for part in candidate.content.parts:
-                    txt = getattr(part, "text", None)
-                    if txt:
-                        full_plain_message += txt
-        if not full_plain_message:
-            pass
         if full_plain_message:
-            message = format_message(full_plain_message)
-            await init_msg.edit_text(
-                text=message,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True,
-            )
+            if not cached:
+                record_tokens(
+                    answered_by,
+                    estimate_text_tokens(prompt) + IMAGE_TOKENS * len(image_parts),
+                    estimate_text_tokens(full_plain_message),
+                )
+            await send_formatted_reply(init_msg, full_plain_message)
             return
         # Diagnose
-        reasons = []
-        if candidate:
-            safety_ratings = getattr(candidate, "safety_ratings", []) or []
-            blocked_categories = []
-            for r in safety_ratings:
-                prob = getattr(r, "probability", None)
-                cat = getattr(r, "category", None)
-                prob_name = getattr(prob, "name", None)
-                cat_name = getattr(cat, "name", None)
-                if prob_name in ("MEDIUM", "HIGH"):
-                    blocked_categories.append(cat_name or "UNKNOWN")
-            if blocked_categories:
-                reasons.append("Safety filter triggered: " + ", ".join(blocked_categories))
-            finish_reason = getattr(candidate, "finish_reason", None)
-            finish_name = getattr(finish_reason, "name", None)
-            if finish_name:
-                reasons.append(f"Finish reason: {finish_name}")
-        else:
-            reasons.append("No candidates returned (model may be unavailable or ID invalid)")
-        diagnostic = "; ".join(reasons) if reasons else "Unknown reason"
+        record_error("EmptyCandidates")
+        diagnostic = diagnose_empty_response(response)
         await init_msg.edit_text(
             f"Image model produced no text. {diagnostic}. Try another model or image."
         )
     except Exception as e:
+        record_error("PostProcessing")
         print("Image post-processing error:", e)
         await init_msg.edit_text("Error processing image response.")
+
+
+_UNSUPPORTED_DOCUMENT = "I can read text files, source code, logs, PDFs and images. This file type isn't supported."
+
+
+@drainable
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle incoming documents (text files, PDFs, images) and generate a response."""
+    document = update.message.document
+    if get_document_kind(document) is None:
+        await update.message.reply_text(_UNSUPPORTED_DOCUMENT)
+        return
+    if document.file_size and document.file_size > DOCUMENT_MAX_SIZE:
+        await update.message.reply_text(too_large_message())
+        return
+    selected_model = context.chat_data.get("selected_model", DEFAULT_MODEL)
+    with request_trace("document", selected_model):
+        async with Placeholder(update.message) as init_msg:
+            await generate_document_reply(update.message, context, init_msg)
+
+
+async def generate_document_reply(
+    message: Message, context: ContextTypes.DEFAULT_TYPE, init_msg: Placeholder
+) -> None:
+    """Sends a document with its caption to the model and replies through `init_msg`.
+
+    The document is streamed to a temporary file. PDFs and images are sent as
+    inline parts. Text that fits into one request is sent as is; longer text is
+    split into chunks that are summarized separately (map), and the question is
+    then answered from those notes (reduce).
+    """
+    selected_model = context.chat_data.get("selected_model", DEFAULT_MODEL)
+    document = message.document
+    name = document.file_name or "file"
+    question = get_prompt_text(message) or "Analyse this file and generate response"
+    on_queued = queued_status(init_msg)
+    hedge = is_hedging_enabled(context.chat_data)
+    response = None
+    # Tokens are charged to the model that answered, which differs after a fallback
+    answered_by = selected_model
+    contents = None
+    prompt_tokens = 0
+    notice = ""
+
+    async def summarize(index: int, total: int, text: str) -> str:
+        nonlocal prompt_tokens
+        # Notes of every part together must fit into a single request
+        words = max(100, get_chunk_size(selected_model) // 6 // min(total, DOCUMENT_MAX_CHUNKS))
+        contents = [
+            f"This is part {index + 1} of {total} of the file {name}:\n\n{text}",
+            f"Take notes of everything in this part that helps to answer: {question}\n"
+            f"Reply with the notes only, in at most {words} words.",
+        ]
+        prompt_tokens += estimate_text_tokens(text)
+
+        async def call(model_id: str):
+            return await call_model(
+                model_id, get_model(model_id).generate_content, contents, on_queued=on_queued
+            )
+
+        _, notes = await call_with_fallback(selected_model, call)
+        return get_response_text(notes)
+
+    async def read_text(path: str) -> list:
+        nonlocal notice
+        chunk_size = get_chunk_size(selected_model)
+        total = count_text_chunks(path, chunk_size)
+        with closing(iter_text_chunks(path, chunk_size)) as chunks:
+            if total == 1:
+                text = next(chunks, "")
+                return [f"File {name}:\n\n{text}", question]
+
+            async def on_progress(done: int) -> None:
+                try:
+                    await init_msg.edit_text(
+                        f"Reading {name}: part {done} of {min(total, DOCUMENT_MAX_CHUNKS)}..."
+                    )
+                except BadRequest:
+                    pass
+
+            with stage("document_map"):
+                notes = await map_chunks(
+                    chunks, lambda i, text: summarize(i, total, text), on_progress
+                )
+        if total > DOCUMENT_MAX_CHUNKS:
+            notice = (
+                f"\n\n_Only the first {DOCUMENT_MAX_CHUNKS} of {total} parts of {name} were read._"
+            )
+        joined = "\n\n".join(f"Part {i + 1}:\n{n}" for i, n in enumerate(notes))
+        return [f"Notes taken from the file {name}, part by part:\n\n{joined}", question]
+
+    async def prepare(path: str, kind: str) -> list:
+        if kind == "unknown":
+            kind = "text" if looks_like_text(path) else None
+        if kind == "text":
+            return await read_text(path)
+        if kind == "pdf":
+            part = await asyncio.to_thread(read_binary_part, path, PDF_MIME_TYPE)
+            return [question, part]
+        if kind == "image":
+            return [question, await get_image_file_part(path, selected_model)]
+        raise DocumentError(_UNSUPPORTED_DOCUMENT)
+
+    async def start_call(model_id: str):
+        return await call_model(
+            model_id,
+            get_model(model_id).generate_content,
+            contents,
+            stream=STREAM_RESPONSES,
+            on_queued=on_queued,
+        )
+
+    async def attempt(model_id: str) -> str:
+        nonlocal response
+        _, response = await hedged_call(model_id, start_call, hedge)
+        if STREAM_RESPONSES:
+            await stream_response(response, init_msg)
+        return get_response_text(response)
+
+    async def generate() -> str:
+        nonlocal contents, prompt_tokens, answered_by
+        with stage("document_prepare"):
+            async with downloaded(document) as path:
+                contents = await prepare(path, get_document_kind(document))
+        prompt_tokens += sum(
+            estimate_text_tokens(c) if isinstance(c, str) else IMAGE_TOKENS for c in contents
+        )
+        with stage("gemini"):
+            model_id, reply = await call_with_fallback(selected_model, attempt)
+        answered_by = model_id
+        if model_id != selected_model:
+            print(f"{selected_model} is unavailable, answered with {model_id}")
+        return reply + notice if reply else reply
+
+    try:
+        cache_key = make_cache_key(
+            selected_model, question, images=[document.file_unique_id.encode()]
+        )
+        full_plain_message, cached = await response_cache.get_or_compute(cache_key, generate)
+    except DocumentError as e:
+        await init_msg.edit_text(str(e))
+        return
+    except asyncio.TimeoutError:
+        record_error("Timeout")
+        await init_msg.edit_text("The model took too long to read the file. Please try again.")
+        return
+    except TooManyRequests as tmr:
+        record_error("QuotaExhausted")
+        print("Quota exhausted for", selected_model, tmr)
+        await init_msg.edit_text("The model is over its rate limit right now. Please try again in a minute.")
+        return
+    except NoOutputError:
+        record_error("NoOutput")
+        await init_msg.edit_text(
+            "File request produced no output (model unavailable). Try another model with /model."
+        )
+        return
+    except Exception as e:
+        record_error(type(e).__name__)
+        print("Document request failed:", e)
+        await init_msg.edit_text("Error reading the file.")
+        return
+
+    try:
+        if full_plain_message:
+            if not cached:
+                record_tokens(
+                    answered_by, prompt_tokens, estimate_text_tokens(full_plain_message)
+                )
+            await send_formatted_reply(init_msg, full_plain_message)
+            return
+        record_error("EmptyCandidates")
+        diagnostic = diagnose_empty_response(response)
+        await init_msg.edit_text(
+            f"Model produced no text for the file. {diagnostic}. Try another model or file."
+        )
+    except Exception as e:
+        record_error("PostProcessing")
+        print("Document post-processing error:", e)
+        await init_msg.edit_text("Error processing the response.")
+
+
+async def answer_inline_query(inline_query: InlineQuery, answer: str, cache_time: int = INLINE_CACHE_TIME) -> None:
+    """Answer an inline query with a single article holding the question and `answer`."""
+    question = inline_query.query.strip()
+    text = split_message(f"<b>{html.escape(question)}</b>\n\n{format_message(answer)}")[0]
+    result = InlineQueryResultArticle(
+        id=get_inline_cache_key(normalize_query(question))[:64],
+        title=question[:100],
+        description=get_description(answer),
+        input_message_content=InputTextMessageContent(
+            text, parse_mode=ParseMode.HTML, disable_web_page_preview=True
+        ),
+    )
+    try:
+        # Answers don't depend on who asked, so Telegram may share them between users
+        await inline_query.answer([result], cache_time=cache_time, is_personal=False)
+    except BadRequest as e:
+        # Usually "Query is too old": the user moved on or the answer took too long
+        print("Failed to answer inline query:", e)
+
+
+@drainable
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer inline queries (`@bot question`) with the model's answer.
+
+    Cached answers are returned right away. Other queries are debounced per
+    user, so only the query the user settled on reaches the model, and
+    identical queries in flight are merged. An answer that is not ready within
+    `INLINE_TIMEOUT` is still cached for when the user asks again.
+    """
+    inline_query = update.inline_query
+    # check_update() only accepts updates with a message
+    if not AuthFilter.filter(update):
+        return
+    query = normalize_query(inline_query.query)
+    if len(query) < INLINE_MIN_LENGTH:
+        INLINE_QUERIES.inc(result="short")
+        return
+
+    answer = get_cached_answer(query)
+    if answer is not None:
+        INLINE_QUERIES.inc(result="cached")
+        await answer_inline_query(inline_query, answer)
+        return
+    if not await debounce(inline_query.from_user.id, inline_query.id):
+        return
+
+    prompt = f"Answer briefly, in a few sentences: {inline_query.query.strip()}"
+
+    async def call(model_id: str):
+        return await call_model(model_id, get_model(model_id).generate_content, prompt)
+
+    async def generate() -> str:
+        with stage("gemini"):
+            _, response = await call_with_fallback(INLINE_MODEL, call)
+        reply = get_response_text(response)
+        if reply:
+            record_tokens(INLINE_MODEL, estimate_text_tokens(prompt), estimate_text_tokens(reply))
+        return reply
+
+    with request_trace("inline", INLINE_MODEL):
+        # Keeps running into the cache if this query times out or is drained
+        task = asyncio.ensure_future(inline_cache.get_or_compute(get_inline_cache_key(query), generate))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            answer, cached = await asyncio.wait_for(asyncio.shield(task), INLINE_TIMEOUT)
+        except asyncio.TimeoutError:
+            record_error("Timeout")
+            INLINE_QUERIES.inc(result="timeout")
+            try:
+                # Nothing to show yet; don't let Telegram cache the empty answer
+                await inline_query.answer([], cache_time=0)
+            except BadRequest:
+                pass
+            return
+        except Exception as e:
+            record_error(type(e).__name__)
+            INLINE_QUERIES.inc(result="failed")
+            print("Inline query failed:", e)
+            return
+        if not answer:
+            record_error("EmptyCandidates")
+            INLINE_QUERIES.inc(result="failed")
+            return
+        INLINE_QUERIES.inc(result="cached" if cached else "answered")
+        await answer_inline_query(inline_query, answer)
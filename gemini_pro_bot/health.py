@@ -0,0 +1,230 @@
+import asyncio
+import os
+import time
+from collections import deque
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    InternalServerError,
+    NotFound,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+from telegram.ext import Application
+from gemini_pro_bot.executor import NoOutputError, run_llm
+from gemini_pro_bot.llm import AVAILABLE_MODELS, get_model_info_by_id, is_model_available
+from gemini_pro_bot.metrics import Counter
+
+# Seconds between background probes of every model (0 disables probing)
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "300"))
+# Seconds a single probe may take before the model counts as down
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "10"))
+# The breaker opens when at least BREAKER_MIN_CALLS calls in the last BREAKER_WINDOW
+# seconds failed at a rate of BREAKER_ERROR_RATE or more
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "120"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "3"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+# Seconds an open breaker waits before letting a trial request through
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+
+# Errors that say something about the model being reachable, as opposed to the prompt
+AVAILABILITY_ERRORS = (
+    ServiceUnavailable,
+    InternalServerError,
+    DeadlineExceeded,
+    NotFound,
+    TooManyRequests,
+    asyncio.TimeoutError,
+    NoOutputError,
+)
+
+FALLBACKS = Counter(
+    "gemini_bot_fallbacks_total",
+    "Requests answered by a fallback model, by selected and serving model.",
+)
+
+
+class CircuitBreaker:
+    """Tracks the recent error rate of one model and stops traffic to it when it is down.
+
+    Closed: calls go through and their outcomes are recorded. Open: calls are
+    routed elsewhere until `BREAKER_COOLDOWN` has passed. Half-open: a single
+    trial call is let through; its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self._outcomes = deque()
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > BREAKER_WINDOW:
+            self._outcomes.popleft()
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self._opened_at = now
+        self._trial_running = False
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self._outcomes.clear()
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        """Whether a call may be sent to the model now."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= BREAKER_COOLDOWN:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Give back a trial call taken by `allow` without recording an outcome."""
+        self._trial_running = False
+
+    def record(self, ok: bool) -> None:
+        """Record the outcome of a call."""
+        now = time.monotonic()
+        if self.state != self.CLOSED:
+            if ok:
+                self._close()
+            else:
+                self._open(now)
+            return
+        self._outcomes.append((now, ok))
+        self._prune(now)
+        failures = sum(1 for _, success in self._outcomes if not success)
+        if (
+            len(self._outcomes) >= BREAKER_MIN_CALLS
+            and failures / len(self._outcomes) >= BREAKER_ERROR_RATE
+        ):
+            self._open(now)
+
+    def record_probe(self, ok: bool) -> None:
+        """Apply a health probe result: a failed probe opens, a passed one closes."""
+        if ok:
+            if self.state != self.CLOSED:
+                self._close()
+        else:
+            self._open(time.monotonic())
+
+
+_breakers = {}
+
+
+def get_breaker(model_id: str) -> CircuitBreaker:
+    """Get the circuit breaker of a model, creating it on first use."""
+    breaker = _breakers.get(model_id)
+    if breaker is None:
+        breaker = _breakers[model_id] = CircuitBreaker()
+    return breaker
+
+
+def fallback_chain(model_id: str) -> list:
+    """Get `model_id` followed by its fallbacks, as linked by "fallback" in AVAILABLE_MODELS."""
+    chain = [model_id]
+    while True:
+        model_info = get_model_info_by_id(chain[-1]) or {}
+        fallback = model_info.get("fallback")
+        if not fallback or fallback in chain:
+            return chain
+        chain.append(fallback)
+
+
+async def call_with_fallback(model_id: str, call) -> tuple:
+    """Run `call(model)` against the first healthy model of `model_id`'s fallback chain.
+
+    Models with an open breaker are skipped without a round-trip. When a call
+    fails with an availability error the next model in the chain is tried. If
+    every model is marked down, the selected model is tried anyway rather than
+    refusing the request outright.
+
+    Args:
+        model_id (str): The model selected by the user.
+        call: Coroutine function taking the model ID to use.
+
+    Returns:
+        tuple: The model ID that answered and the return value of `call`.
+
+    Raises:
+        The last availability error if every model of the chain failed, or any
+        other error raised by `call` unchanged.
+    """
+    chain = fallback_chain(model_id)
+    last_error = None
+    for candidate in chain:
+        breaker = get_breaker(candidate)
+        if not breaker.allow():
+            continue
+        try:
+            result = await call(candidate)
+        except AVAILABILITY_ERRORS as e:
+            breaker.record(False)
+            last_error = e
+            print(f"{candidate} failed ({type(e).__name__}), trying the next fallback")
+            continue
+        except BaseException:
+            # Not the model's fault (e.g. a blocked prompt or a cancelled request);
+            # don't count it either way, but free a half-open trial for the next call
+            breaker.release()
+            raise
+        breaker.record(True)
+        if candidate != model_id:
+            FALLBACKS.inc(selected=model_id, model=candidate)
+        return candidate, result
+    if last_error is not None:
+        raise last_error
+    result = await call(model_id)
+    get_breaker(model_id).record(True)
+    return model_id, result
+
+
+async def probe_models() -> dict:
+    """Probe every model in AVAILABLE_MODELS once and update their breakers."""
+    results = {}
+    for model_info in AVAILABLE_MODELS.values():
+        model_id = model_info["id"]
+        try:
+            ok = await run_llm(is_model_available, model_id, timeout=HEALTH_CHECK_TIMEOUT)
+        except asyncio.TimeoutError:
+            ok = False
+        get_breaker(model_id).record_probe(ok)
+        results[model_id] = ok
+    return results
+
+
+async def _probe_loop() -> None:
+    while True:
+        try:
+            results = await probe_models()
+            down = [m for m, ok in results.items() if not ok]
+            if down:
+                print("Models failing health checks:", ", ".join(down))
+        except Exception as e:
+            print("Health check failed:", e)
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+
+async def start_health_checker(application: Application) -> None:
+    """Start probing models in the background (post_init callback)."""
+    if HEALTH_CHECK_INTERVAL > 0:
+        application.bot_data["health_checker"] = asyncio.create_task(_probe_loop())
+
+
+async def stop_health_checker(application: Application) -> None:
+    """Stop the background prober (post_shutdown callback)."""
+    task = application.bot_data.pop("health_checker", None)
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+from collections import deque
+from gemini_pro_bot.metrics import Counter
+
+# Hedge requests in every chat by default; chats can still toggle it with /hedge
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "false").strip().lower() in ("1", "true", "yes")
+# Faster model the backup request is sent to
+HEDGE_MODEL = os.getenv("HEDGE_MODEL", "gemini-2.5-flash-lite")
+# The backup is sent once the primary is slower than this percentile of its recent latencies
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+# Deadline in seconds used until a model has HEDGE_MIN_SAMPLES latency samples
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "4"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+_SAMPLE_SIZE = 200
+
+HEDGE_OUTCOMES = Counter(
+    "gemini_bot_hedge_outcomes_total",
+    "Hedged requests by primary model, winning model and whether a backup was sent.",
+)
+
+_latencies = {}
+
+
+def record_latency(model_id: str, seconds: float) -> None:
+    """Record how long a model took to start answering."""
+    samples = _latencies.get(model_id)
+    if samples is None:
+        samples = _latencies[model_id] = deque(maxlen=_SAMPLE_SIZE)
+    samples.append(seconds)
+
+
+def get_hedge_delay(model_id: str) -> float:
+    """Get the seconds to wait for `model_id` before sending a backup request."""
+    samples = _latencies.get(model_id)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(HEDGE_PERCENTILE * len(ordered)))
+    return ordered[index]
+
+
+def is_hedging_enabled(chat_data: dict) -> bool:
+    """Whether requests of a chat are hedged."""
+    return chat_data.get("hedge", HEDGE_REQUESTS)
+
+
+async def _timed(model_id: str, start):
+    started = time.monotonic()
+    try:
+        result = await start(model_id)
+    except asyncio.CancelledError:
+        # A call that lost the race was at least this slow; leaving it out would
+        # drop the slow tail from the samples and make hedges ever more frequent
+        record_latency(model_id, time.monotonic() - started)
+        raise
+    record_latency(model_id, time.monotonic() - started)
+    return result
+
+
+async def hedged_call(model_id: str, start, enabled: bool = True) -> tuple:
+    """Start a model call, and race a backup on `HEDGE_MODEL` if it is slow.
+
+    The primary call gets `get_hedge_delay(model_id)` seconds. If it has not
+    finished by then, the same call is started against `HEDGE_MODEL` and
+    whichever finishes first wins; the other is cancelled. If one of them fails
+    the other is still awaited. Latencies of every call feed the deadline; a
+    cancelled call counts with the time it ran, a lower bound of its latency.
+
+    Args:
+        model_id (str): The primary model.
+        start: Coroutine function taking a model ID and starting the call, e.g.
+            returning the response once its first chunk arrived.
+        enabled (bool): Whether to hedge at all. When False the primary call is
+            awaited alone (and still timed).
+
+    Returns:
+        tuple: The model ID that won and the return value of `start`.
+    """
+    if not enabled or model_id == HEDGE_MODEL:
+        return model_id, await _timed(model_id, start)
+
+    primary = asyncio.ensure_future(_timed(model_id, start))
+    tasks = {primary: model_id}
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=get_hedge_delay(model_id))
+        if done:
+            HEDGE_OUTCOMES.inc(primary=model_id, winner=model_id, hedged="no")
+            return model_id, primary.result()
+
+        backup = asyncio.ensure_future(_timed(HEDGE_MODEL, start))
+        tasks[backup] = HEDGE_MODEL
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Prefer a successful call when both finished at once
+            for task in sorted(done, key=lambda t: t.exception() is not None):
+                if task.exception() is None or not pending:
+                    winner = tasks[task]
+                    HEDGE_OUTCOMES.inc(primary=model_id, winner=winner, hedged="yes")
+                    # Raises the error of the last call if both failed
+                    return winner, task.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,72 @@
+import os
+from gemini_pro_bot.llm import get_model_info_by_id
+
+# Defaults for models without "history_turns" / "history_tokens" in AVAILABLE_MODELS
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "20"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "32000"))
+
+# Gemini bills an image as a fixed number of tokens
+IMAGE_TOKENS = 258
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Estimate the token count of a text (roughly four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def estimate_content_tokens(content) -> int:
+    """Estimate the token count of a `glm.Content` from the history."""
+    tokens = 0
+    for part in content.parts:
+        if part.text:
+            tokens += estimate_text_tokens(part.text)
+        elif "inline_data" in part:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def get_history_policy(model_id: str) -> tuple:
+    """Get the `(max turns, token budget)` history policy of a model."""
+    model_info = get_model_info_by_id(model_id) or {}
+    return (
+        model_info.get("history_turns", HISTORY_MAX_TURNS),
+        model_info.get("history_tokens", HISTORY_TOKEN_BUDGET),
+    )
+
+
+def trim_history(chat, model_id: str, prompt: str) -> int:
+    """Drop the oldest turns of a chat so the next request fits the model's policy.
+
+    Whole user/model turns are removed from the front of the history until at
+    most `history_turns` turns remain and the estimated size of the history plus
+    `prompt` fits into `history_tokens`. The most recent turn is never dropped
+    for the budget alone.
+
+    Args:
+        chat: The `ChatSession` about to be sent a message.
+        model_id (str): The model the chat is using.
+        prompt (str): The message that will be sent.
+
+    Returns:
+        int: The estimated number of tokens that will be sent.
+    """
+    max_turns, budget = get_history_policy(model_id)
+    history = chat.history
+    sizes = [estimate_content_tokens(content) for content in history]
+    total = sum(sizes) + estimate_text_tokens(prompt)
+
+    start = 0
+    while len(history) - start >= 2 and (
+        (len(history) - start) // 2 > max_turns
+        or (total > budget and len(history) - start > 2)
+    ):
+        total -= sizes[start] + sizes[start + 1]
+        start += 2
+    # Never start the window on a model reply
+    while start < len(history) and history[start].role != "user":
+        total -= sizes[start]
+        start += 1
+
+    if start:
+        chat.history = history[start:]
+    return total
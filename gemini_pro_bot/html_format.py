@@ -175,11 +175,124 @@ def apply_exclude_code(text: str) -> str:
     return "\n".join(lines)
 
 
+_INLINE_SPECIAL = re.compile(r"[`\[*_~]")
+_HEADER = re.compile(r"(#{1,6})\s+")
+_CODE_LANG = re.compile(r"[^\w+#.-]")
+# Emphasis markers, longest first so "**" is not read as two "*"
+_EMPHASIS_MARKERS = (("**", "b"), ("__", "u"), ("~~", "s"), ("*", "i"))
+
+
+def _is_open_marker(line: str, start: int, end: int, marker: str) -> bool:
+    """Check whether the marker at line[start:end] can open an emphasis span.
+
+    The marker must be followed by a non-space character and be closed later
+    on the same line by a marker that is not preceded by a space.
+    """
+    if end >= len(line) or line[end].isspace():
+        return False
+    close = line.find(marker, end + 1)
+    while close != -1:
+        if not line[close - 1].isspace():
+            return True
+        close = line.find(marker, close + 1)
+    return False
+
+
+def _render_inline(line: str) -> str:
+    """Render inline markdown of a single line into Telegram HTML in one scan.
+
+    Handles inline code, links, bold, italic, underline and strikethrough.
+    Emphasis tags are tracked on a stack so the output is always correctly
+    nested: closing an outer span closes and reopens the spans opened inside it,
+    and spans left unclosed at the end of the line fall back to literal text.
+
+    Args:
+        line (str): A line of unescaped markdown text.
+
+    Returns:
+        str: The escaped, formatted HTML of the line.
+    """
+    out = []
+    # Open emphasis spans: [marker, tag, index of the opening tag in out, reopened]
+    stack = []
+    pos = 0
+    n = len(line)
+    while pos < n:
+        match = _INLINE_SPECIAL.search(line, pos)
+        if match is None:
+            out.append(escape_html(line[pos:]))
+            break
+        i = match.start()
+        if i > pos:
+            out.append(escape_html(line[pos:i]))
+        char = line[i]
+
+        if char == "`":
+            end = line.find("`", i + 1)
+            if end != -1:
+                out.append("<code>" + escape_html(line[i + 1 : end]) + "</code>")
+                pos = end + 1
+                continue
+        elif char == "[":
+            close = line.find("](", i + 1)
+            end = line.find(")", close + 2) if close != -1 else -1
+            if end != -1:
+                url = escape_html(line[close + 2 : end]).replace('"', "&quot;")
+                label = _render_inline(line[i + 1 : close])
+                out.append(f'<a href="{url}">{label}</a>')
+                pos = end + 1
+                continue
+        else:
+            for marker, tag in _EMPHASIS_MARKERS:
+                if not line.startswith(marker, i):
+                    continue
+                end = i + len(marker)
+                depth = next(
+                    (d for d in range(len(stack) - 1, -1, -1) if stack[d][0] == marker), -1
+                )
+                if depth != -1 and stack[depth][3] and stack[depth][2] == len(out) - 1:
+                    # Closing a span that was reopened with nothing in it: drop the tag
+                    out.pop()
+                    del stack[depth]
+                    pos = end
+                    break
+                if depth != -1 and i > 0 and not line[i - 1].isspace():
+                    # Close spans opened inside this one, close it, then reopen them
+                    inner = stack[depth + 1 :]
+                    del stack[depth:]
+                    out.extend(f"</{t}>" for _, t, _, _ in reversed(inner))
+                    out.append(f"</{tag}>")
+                    for m, t, _, _ in inner:
+                        stack.append([m, t, len(out), True])
+                        out.append(f"<{t}>")
+                    pos = end
+                    break
+                if depth == -1 and _is_open_marker(line, i, end, marker):
+                    stack.append([marker, tag, len(out), False])
+                    out.append(f"<{tag}>")
+                    pos = end
+                    break
+            else:
+                out.append(escape_html(char))
+                pos = i + 1
+            continue
+
+        out.append(escape_html(char))
+        pos = i + 1
+
+    # Spans that never closed: drop their tags and restore the literal markers
+    for marker, tag, index, reopened in stack:
+        out[index] = "" if reopened else escape_html(marker)
+    return "".join(out)
+
+
 def format_message(text: str) -> str:
     """Format the given message text from markdown to HTML.
 
-    Escapes HTML characters, applies link, code, and other rich text formatting,
-    and returns the formatted HTML string.
+    Walks the text once, line by line, instead of running a regex pass per
+    formatting rule. Fenced code blocks are escaped verbatim, headers and bullet
+    points are handled at the start of a line, and the rest of each line goes
+    through a single inline scan that always produces correctly nested tags.
 
     Args:
       message (str): The plain text message to format.
@@ -187,7 +300,157 @@ def format_message(text: str) -> str:
     Returns:
       str: The formatted HTML string.
     """
-    formatted_text = escape_html(text)
-    formatted_text = apply_exclude_code(formatted_text)
-    formatted_text = apply_code(formatted_text)
-    return formatted_text
+    lines = text.split("\n")
+    out = []
+    i = 0
+    n = len(lines)
+    while i < n:
+        line = lines[i]
+        stripped = line.lstrip()
+        if stripped.startswith("```"):
+            lang = _CODE_LANG.sub("", stripped[3:].strip())
+            end = i + 1
+            while end < n and not lines[end].lstrip().startswith("```"):
+                end += 1
+            code = escape_html("\n".join(lines[i + 1 : end]))
+            if lang:
+                out.append(f'<pre><code class="language-{lang}">{code}</code></pre>')
+            else:
+                out.append(f"<pre>{code}</pre>")
+            i = end + 1
+            continue
+
+        header = _HEADER.match(line)
+        if header:
+            out.append("<b><u>" + _render_inline(line[header.end() :]) + "</u></b>")
+        elif stripped.startswith("* ") and not stripped.startswith("**"):
+            indent = line[: len(line) - len(stripped)]
+            out.append(indent + "👉 " + _render_inline(stripped[2:]))
+        else:
+            out.append(_render_inline(line))
+        i += 1
+    return "\n".join(out)
+
+
+TELEGRAM_MAX_LENGTH = 4096
+_HTML_TOKEN = re.compile(r"<[^>]*>|[^<]+")
+_HTML_TAG = re.compile(r"<[^>]*>")
+
+
+def utf16_len(text: str) -> int:
+    """Length of a string in UTF-16 code units, the unit Telegram's limits use."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _safe_cut(text: str, room: int) -> int:
+    """Pick where to hard-cut a text piece so it fits in `room` characters.
+
+    Prefers the last space, and never cuts inside an HTML entity such as `&amp;`.
+    """
+    # Longest head that fits; wide characters (e.g. emoji) take two units
+    low, high = 0, min(room, len(text))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if utf16_len(text[:mid]) <= room:
+            low = mid
+        else:
+            high = mid - 1
+    cut = low
+    space = text.rfind(" ", 0, cut)
+    if space > cut // 2:
+        cut = space + 1
+    amp = text.rfind("&", 0, cut)
+    if amp != -1 and text.find(";", amp, cut) == -1:
+        cut = amp
+    return cut
+
+
+def split_message(text: str, limit: int = TELEGRAM_MAX_LENGTH) -> list:
+    """Split formatted HTML into chunks that each fit into one Telegram message.
+
+    Chunks are cut at a blank line if one exists in the second half of the chunk,
+    otherwise at the last line break, and only as a last resort inside a line.
+    Tags open at a cut (e.g. `<pre>` or `<b>`) are closed at the end of the chunk
+    and reopened at the start of the next one, so every chunk is valid HTML.
+    Chunks without visible text, which Telegram would reject, are dropped.
+
+    Args:
+        text (str): The HTML produced by `format_message`.
+        limit (int): The maximum length of a chunk in UTF-16 code units.
+
+    Returns:
+        list[str]: The chunks, in order.
+    """
+    if utf16_len(text) <= limit:
+        return [text]
+
+    chunks = []
+    parts = []  # pieces of the chunk being built
+    size = 0
+    stack = []  # (opening tag, closing tag) of the currently open elements
+    base = 0  # number of reopened tags at the start of the chunk
+    line_break = paragraph_break = None  # (index into parts, stack) of the last breaks
+
+    def closing(tags) -> str:
+        return "".join(close for _, close in reversed(tags))
+
+    def flush(cut: int, cut_stack: list) -> None:
+        nonlocal parts, size, base, line_break, paragraph_break
+        head, tail = parts[:cut], parts[cut:]
+        chunks.append("".join(head) + closing(cut_stack))
+        parts = [open_tag for open_tag, _ in cut_stack] + tail
+        base = len(cut_stack)
+        size = sum(utf16_len(p) for p in parts)
+        line_break = paragraph_break = None
+
+    def flush_at_break() -> bool:
+        for brk in (paragraph_break, line_break):
+            if brk is not None and brk[0] > base and (brk is line_break or brk[0] * 2 > len(parts)):
+                flush(*brk)
+                return True
+        return False
+
+    for token in _HTML_TOKEN.findall(text):
+        if token.startswith("</"):
+            stack.pop()
+            parts.append(token)
+            size += utf16_len(token)
+            continue
+        if token.startswith("<"):
+            name = token[1:].split(None, 1)[0].rstrip(">")
+            needed = utf16_len(token) + len(name) + 3
+            if size + needed + utf16_len(closing(stack)) > limit:
+                if not flush_at_break():
+                    flush(len(parts), stack)
+            stack.append((token, f"</{name}>"))
+            parts.append(token)
+            size += utf16_len(token)
+            continue
+
+        for piece in token.splitlines(keepends=True):
+            while piece:
+                room = limit - size - utf16_len(closing(stack))
+                if utf16_len(piece) <= room:
+                    parts.append(piece)
+                    size += utf16_len(piece)
+                    piece = ""
+                    break
+                if flush_at_break():
+                    continue
+                cut = _safe_cut(piece, room) if room > 0 else 0
+                if cut == 0 and len(parts) == base:
+                    # Nothing fits even in an empty chunk, force progress
+                    cut = max(1, min(room, len(piece)))
+                if cut:
+                    parts.append(piece[:cut])
+                    piece = piece[cut:]
+                flush(len(parts), stack)
+            if parts and parts[-1].endswith("\n"):
+                brk = (len(parts), list(stack))
+                if parts[-1] == "\n" or (len(parts) > 1 and parts[-2].endswith("\n")):
+                    paragraph_break = brk
+                line_break = brk
+
+    if len(parts) > base:
+        chunks.append("".join(parts) + closing(stack))
+    return [chunk for chunk in chunks if _HTML_TAG.sub("", chunk).strip()] or chunks[:1]
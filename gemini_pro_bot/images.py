@@ -0,0 +1,125 @@
+import asyncio
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from telegram import PhotoSize
+from gemini_pro_bot.llm import get_model_info_by_id
+
+# Longest image side sent to models without "image_side" in AVAILABLE_MODELS
+IMAGE_TARGET_SIDE = int(os.getenv("IMAGE_TARGET_SIDE", "1024"))
+# Worker processes used to decode and re-encode images
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "1"))
+# Number of prepared images kept in memory, keyed by Telegram's file_unique_id
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "128"))
+
+IMAGE_MIME_TYPE = "image/jpeg"
+
+_pool = None
+_cache = OrderedDict()
+
+
+def get_target_side(model_id: str) -> int:
+    """Get the longest image side, in pixels, worth sending to a model."""
+    model_info = get_model_info_by_id(model_id) or {}
+    return model_info.get("image_side", IMAGE_TARGET_SIDE)
+
+
+def pick_photo_size(photos, target_side: int) -> PhotoSize:
+    """Pick the smallest size of a photo that still covers `target_side`.
+
+    Args:
+        photos: The `PhotoSize` list of one photo, as in `Message.photo`.
+        target_side (int): The longest side the model needs.
+
+    Returns:
+        PhotoSize: The smallest size at least `target_side` pixels on its longest
+        side, or the largest size available if none is that big.
+    """
+    ordered = sorted(photos, key=lambda p: p.width * p.height)
+    for photo in ordered:
+        if max(photo.width, photo.height) >= target_side:
+            return photo
+    return ordered[-1]
+
+
+def prepare_image(data, target_side: int) -> bytes:
+    """Decode an image, downscale it to `target_side` and re-encode it as JPEG.
+
+    Runs in a worker process so decoding never blocks the event loop.
+
+    Args:
+        data: The encoded image, as bytes or the path of a file.
+        target_side (int): The longest side of the prepared image.
+    """
+    import PIL.Image as load_image
+
+    image = load_image.open(BytesIO(data) if isinstance(data, bytes) else data)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((target_side, target_side))
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # The pool starts after the executor threads and gRPC, and forking a
+        # multi-threaded process can deadlock the child; spawn a fresh interpreter
+        _pool = ProcessPoolExecutor(
+            max_workers=IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+async def get_image_part(photos, model_id: str) -> dict:
+    """Download and prepare a Telegram photo as an inline image part for Gemini.
+
+    Prepared images are cached by `file_unique_id` and target size, so asking
+    about the same photo again does not download or re-encode it.
+
+    Args:
+        photos: The `PhotoSize` list of one photo, as in `Message.photo`.
+        model_id (str): The model the image is sent to.
+
+    Returns:
+        dict: A `{"mime_type": ..., "data": ...}` blob accepted by `generate_content`.
+    """
+    target_side = get_target_side(model_id)
+    photo = pick_photo_size(photos, target_side)
+    key = (photo.file_unique_id, target_side)
+    data = _cache.get(key)
+    if data is None:
+        file = await photo.get_file()
+        raw = bytes(await file.download_as_bytearray())
+        data = await asyncio.get_running_loop().run_in_executor(
+            _get_pool(), prepare_image, raw, target_side
+        )
+        _cache[key] = data
+        while len(_cache) > IMAGE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    _cache.move_to_end(key)
+    return {"mime_type": IMAGE_MIME_TYPE, "data": data}
+
+
+async def get_image_file_part(path: str, model_id: str) -> dict:
+    """Prepare an image file (e.g. a photo sent as a document) as an inline image part.
+
+    The worker process reads the file itself, so the original is never loaded
+    into the bot's memory.
+    """
+    data = await asyncio.get_running_loop().run_in_executor(
+        _get_pool(), prepare_image, path, get_target_side(model_id)
+    )
+    return {"mime_type": IMAGE_MIME_TYPE, "data": data}
+
+
+def shutdown_image_pool() -> None:
+    """Stop the image worker processes."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import re
+from gemini_pro_bot.cache import ResponseCache, make_cache_key
+from gemini_pro_bot.metrics import Counter, register_gauge
+
+# Model answering inline queries (@bot question); a fast one keeps up with typing
+INLINE_MODEL = os.getenv("INLINE_MODEL", "gemini-2.5-flash-lite")
+# Seconds a user must stop typing before their inline query is sent to the model
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", "0.8"))
+# Queries shorter than this many characters are not answered
+INLINE_MIN_LENGTH = int(os.getenv("INLINE_MIN_LENGTH", "3"))
+# Seconds to wait for an answer before replying without results; it is still cached
+INLINE_TIMEOUT = float(os.getenv("INLINE_TIMEOUT", "8"))
+# Number of answers kept and seconds they stay valid
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "1024"))
+INLINE_CACHE_TTL = float(os.getenv("INLINE_CACHE_TTL", "3600"))
+# Seconds Telegram may cache an answer on its side (cache_time of answerInlineQuery)
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+
+INLINE_QUERIES = Counter(
+    "gemini_bot_inline_queries_total",
+    "Inline queries by outcome (short, superseded, cached, answered, timeout, failed).",
+)
+
+# Unlike chat replies, inline answers are always reused: the same question
+# typed by anyone gets the same answer until it expires
+inline_cache = ResponseCache(INLINE_CACHE_SIZE, INLINE_CACHE_TTL, store=True)
+register_gauge(
+    "gemini_bot_inline_cache_hit_rate",
+    "Share of inline queries answered from the cache or an identical in-flight query.",
+    lambda: inline_cache.stats()["hit_rate"],
+)
+
+# Latest inline query ID of each user, for dropping superseded queries
+_latest = {}
+
+
+def normalize_query(text: str) -> str:
+    """Normalize an inline query so trivially different spellings share an answer.
+
+    Case, surrounding and repeated whitespace and trailing punctuation are ignored.
+    """
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!.").strip().lower()
+
+
+def get_description(answer: str, limit: int = 200) -> str:
+    """Build the plain-text preview of an answer shown in the list of inline results."""
+    return " ".join(re.sub(r"[#*_`>|~]+", "", answer).split())[:limit]
+
+
+def get_inline_cache_key(query: str) -> str:
+    """Build the answer cache key of a normalized query."""
+    return make_cache_key(INLINE_MODEL, query)
+
+
+def get_cached_answer(query: str) -> str:
+    """Get the cached answer of a normalized query, or None."""
+    return inline_cache.get(get_inline_cache_key(query))
+
+
+async def debounce(user_id: int, query_id: str) -> bool:
+    """Wait until a user stopped typing.
+
+    Telegram sends a new inline query on almost every keystroke. Each one
+    replaces the user's previous query; after `INLINE_DEBOUNCE` seconds only the
+    latest is still current.
+
+    Returns:
+        bool: Whether `query_id` is still the user's latest query.
+    """
+    _latest[user_id] = query_id
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    if _latest.get(user_id) != query_id:
+        INLINE_QUERIES.inc(result="superseded")
+        return False
+    del _latest[user_id]
+    return True
@@ -0,0 +1,149 @@
+import asyncio
+import functools
+import os
+import signal
+import time
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+from gemini_pro_bot import STARTED_AT
+from gemini_pro_bot.executor import llm_executor
+from gemini_pro_bot.images import shutdown_image_pool
+from gemini_pro_bot.llm import load_sdk
+
+# Seconds in-flight requests get to finish on shutdown. Keep it below fly.toml's
+# kill_timeout, leaving time to tell users about cancelled requests and to save sessions.
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "3"))
+
+_NOTICE_TIMEOUT = 1
+
+_startup_marks = []
+_in_flight = set()
+_cancelled_by_drain = set()
+
+
+def mark_startup(step: str) -> None:
+    """Record that a start-up step finished, for `report_startup`."""
+    _startup_marks.append((step, time.perf_counter()))
+
+
+def report_startup() -> None:
+    """Print how long each start-up step took."""
+    previous = STARTED_AT
+    steps = []
+    for step, at in _startup_marks:
+        steps.append(f"{step} {at - previous:.2f}s")
+        previous = at
+    print(f"Started in {previous - STARTED_AT:.2f}s ({', '.join(steps)})")
+
+
+async def warm_up(application: Application) -> None:
+    """Load the Gemini SDK in the background so the first request doesn't pay for it."""
+    application.bot_data["sdk_warm_up"] = asyncio.create_task(asyncio.to_thread(load_sdk))
+
+
+def drainable(handler):
+    """Track a handler's work so shutdown can wait for it to finish.
+
+    Work still running after `DRAIN_TIMEOUT` on shutdown is cancelled, and the
+    user is asked to send the message again once the bot is back.
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        task = asyncio.ensure_future(handler(update, context))
+        _in_flight.add(task)
+        task.add_done_callback(_in_flight.discard)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task not in _cancelled_by_drain:
+                raise
+            if update.effective_message is not None:
+                try:
+                    await asyncio.wait_for(
+                        update.effective_message.reply_text(
+                            "The bot is restarting. Please send that again in a moment."
+                        ),
+                        _NOTICE_TIMEOUT,
+                    )
+                except Exception:
+                    pass
+
+    return wrapper
+
+
+async def drain_requests(timeout: float = DRAIN_TIMEOUT) -> None:
+    """Wait up to `timeout` seconds for in-flight requests, then cancel the rest."""
+    tasks = set(_in_flight)
+    if not tasks:
+        return
+    print(f"Waiting up to {timeout}s for {len(tasks)} in-flight requests")
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    if pending:
+        print(f"Cancelling {len(pending)} requests still running")
+        for task in pending:
+            _cancelled_by_drain.add(task)
+            task.cancel()
+        await asyncio.wait(pending)
+
+
+def stop_event() -> asyncio.Event:
+    """Get an event that is set on SIGINT or SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    return stop
+
+
+async def shutdown_application(application: Application, stop_receiving) -> None:
+    """Stop taking updates, drain in-flight requests and shut the Application down.
+
+    Args:
+        application (Application): The running application.
+        stop_receiving: Coroutine function that stops the update source
+            (the updater or the webhook server).
+    """
+    started = time.perf_counter()
+    await stop_receiving()
+    await drain_requests()
+    if application.running:
+        await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    llm_executor.shutdown(wait=False)
+    shutdown_image_pool()
+    print(f"Shut down in {time.perf_counter() - started:.2f}s")
+
+
+async def run_polling(application: Application) -> None:
+    """Poll Telegram for updates until SIGINT/SIGTERM, then shut down gracefully.
+
+    Mirrors the lifecycle of `Application.run_polling`, but drains in-flight
+    requests within `DRAIN_TIMEOUT` before stopping the Application.
+    """
+    stop = stop_event()
+    await application.initialize()
+    mark_startup("initialize")
+
+    async def stop_polling() -> None:
+        if application.updater.running:
+            await application.updater.stop()
+
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        mark_startup("post_init")
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        mark_startup("polling")
+        report_startup()
+        await stop.wait()
+    finally:
+        await shutdown_application(application, stop_polling)
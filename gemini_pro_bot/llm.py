@@ -1,78 +1,154 @@
 import os
-import google.generativeai as genai
-from google.generativeai.types.safety_types import HarmCategory, HarmBlockThreshold
-from dotenv import load_dotenv
-
-load_dotenv()
+import threading
+import time
 
 # Disable all safety filters
 SAFETY_SETTINGS = {
-    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
+    "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
+    "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
 }
 
-# Available models list
+# Available models list. "rpm" is the requests-per-minute budget used to throttle calls,
+# "history_turns" / "history_tokens" bound how much chat history is resent per message,
+# "image_side" is the longest image side (in pixels) sent to the model,
+# "fallback" is the model requests go to while this one is unhealthy
 AVAILABLE_MODELS = {
     "1": {
         "name": "Gemini 2.5 Pro",
         "id": "gemini-2.5-pro",
-        "description": "Most capable model for complex reasoning tasks"
+        "description": "Most capable model for complex reasoning tasks",
+        "rpm": 5,
+        "history_turns": 30,
+        "history_tokens": 64000,
+        "image_side": 1536,
+        "fallback": "gemini-2.5-flash",
     },
     "2": {
         "name": "Gemini 2.5 Flash",
         "id": "gemini-2.5-flash",
-        "description": "Fast and efficient for most tasks"
+        "description": "Fast and efficient for most tasks",
+        "rpm": 10,
+        "history_turns": 30,
+        "history_tokens": 64000,
+        "image_side": 1024,
+        "fallback": "gemini-2.5-flash-lite",
     },
     "3": {
         "name": "Gemini 2.5 Flash Lite",
         "id": "gemini-2.5-flash-lite",
-        "description": "Lightweight version for simple tasks"
+        "description": "Lightweight version for simple tasks",
+        "rpm": 15,
+        "history_turns": 20,
+        "history_tokens": 32000,
+        "image_side": 768,
+        "fallback": "gemini-2.5-flash",
     },
     "4": {
         "name": "Gemini 2.5 Flash Live",
         "id": "gemini-2.5-flash-live",
-        "description": "Real-time streaming capabilities"
+        "description": "Real-time streaming capabilities",
+        "rpm": 10,
+        "history_turns": 20,
+        "history_tokens": 32000,
+        "image_side": 768,
+        "fallback": "gemini-2.5-flash-lite",
     }
 }
 
 DEFAULT_MODEL = "gemini-2.5-flash-lite"
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# Optional sampling temperature for all models; unset keeps each model's default
+GENERATION_CONFIG = (
+    {"temperature": float(os.getenv("GEMINI_TEMPERATURE"))}
+    if os.getenv("GEMINI_TEMPERATURE")
+    else None
+)
+
+_sdk = None
+_sdk_lock = threading.Lock()
+
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+_model_cache_stats = {"hits": 0, "misses": 0}
+
+
+def load_sdk():
+    """Import and configure the Gemini SDK on first use.
+
+    Importing `google.generativeai` takes most of the bot's start-up time, so it
+    is deferred until a model is first needed (or warmed up after start-up).
+
+    Returns:
+        module: The configured `google.generativeai` module.
+    """
+    global _sdk
+    with _sdk_lock:
+        if _sdk is None:
+            started = time.perf_counter()
+            import google.generativeai as genai
+
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+            _sdk = genai
+            print(f"Gemini SDK loaded in {time.perf_counter() - started:.2f}s")
+        return _sdk
 
 
-def get_model(model_id: str = None):
-    """Get a model instance with the specified model ID."""
+def _safety_key(safety_settings) -> tuple:
+    """Build a hashable cache key from a safety settings mapping."""
+    if not safety_settings:
+        return ()
+    return tuple(sorted((str(k), str(v)) for k, v in safety_settings.items()))
+
+
+def get_model(model_id: str = None, safety_settings=None):
+    """Get a shared model instance with the specified model ID.
+
+    Models are built once on first use and cached by model ID and safety settings,
+    so every chat using the same model shares a single `GenerativeModel`.
+    """
     if model_id is None:
         model_id = DEFAULT_MODEL
-    try:
-        return genai.GenerativeModel(model_id, safety_settings=SAFETY_SETTINGS)
-    except Exception as e:
-        # If model id invalid/unavailable, raise a clearer error so caller can handle
-        raise RuntimeError(f"Failed to initialize model '{model_id}': {e}")
+    if safety_settings is None:
+        safety_settings = SAFETY_SETTINGS
+    key = (model_id, _safety_key(safety_settings))
+    genai = load_sdk()
+    with _model_cache_lock:
+        model = _model_cache.get(key)
+        if model is not None:
+            _model_cache_stats["hits"] += 1
+            return model
+        _model_cache_stats["misses"] += 1
+        try:
+            model = genai.GenerativeModel(
+                model_id,
+                safety_settings=safety_settings,
+                generation_config=GENERATION_CONFIG,
+            )
+        except Exception as e:
+            # If model id invalid/unavailable, raise a clearer error so caller can handle
+            raise RuntimeError(f"Failed to initialize model '{model_id}': {e}")
+        _model_cache[key] = model
+        return model
+
+
+def get_model_cache_stats() -> dict:
+    """Return the model registry hit/miss counters and number of cached models."""
+    with _model_cache_lock:
+        return dict(_model_cache_stats, size=len(_model_cache))
 
 
 def is_model_available(model_id: str) -> bool:
     """Lightweight probe to check if a model appears available.
 
-    We attempt a minimal generation and catch StopIteration / transport errors.
-    Returns False if the model produces no output or raises availability errors.
+    Counts the tokens of a one-word prompt, which reaches the model's endpoint
+    without spending a generation (or the model's request quota).
+    Returns False if the model is unknown or the call raises an error.
     """
     try:
-        model = genai.GenerativeModel(model_id, safety_settings=SAFETY_SETTINGS)
-        # Minimal non-streaming call; using a very short prompt
-        resp = model.generate_content("ping", stream=False)
-        # Check for valid parts instead of using resp.text directly
-        if hasattr(resp, 'candidates') and resp.candidates:
-            candidate = resp.candidates[0]
-            if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                for part in candidate.content.parts:
-                    if hasattr(part, 'text') and part.text:
-                        return True
-        return False
-    except StopIteration:
-        return False
+        model = get_model(model_id)
+        return model.count_tokens("ping").total_tokens > 0
     except Exception:
         return False
 
@@ -95,6 +171,9 @@ def get_model_name_by_id(model_id: str):
     return "Unknown Model"
 
 
-# Default model instances (will be replaced with user-specific models)
-model = get_model(DEFAULT_MODEL)
-img_model = get_model(DEFAULT_MODEL)
+def get_model_info_by_id(model_id: str):
+    """Get the AVAILABLE_MODELS entry of a model by its ID, or None if unknown."""
+    for model_info in AVAILABLE_MODELS.values():
+        if model_info['id'] == model_id:
+            return model_info
+    return None
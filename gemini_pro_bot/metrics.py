@@ -0,0 +1,196 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http import HTTPStatus
+
+# Print one JSON line per handled request with its stage timings and outcome
+STRUCTURED_LOGS = os.getenv("STRUCTURED_LOGS", "false").strip().lower() in ("1", "true", "yes")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_lock = threading.Lock()
+_metrics = []
+_gauges = []
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{str(v)}"' for k, v in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """A monotonically increasing counter with optional labels."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """A cumulative histogram with fixed buckets and optional labels."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = _LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, sum and count
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[len(self.buckets)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in sorted(self._values.items()):
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                labels = _format_labels(key + (("le", bound),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {counts[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {counts[-1]}")
+        return lines
+
+
+def register_gauge(name: str, help_text: str, read) -> None:
+    """Expose a value read at scrape time, e.g. a queue depth."""
+    _gauges.append((name, help_text, read))
+
+
+def render_metrics() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for metric in _metrics:
+            lines.extend(metric.render())
+    for name, help_text, read in _gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {read()}")
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_endpoint(headers: dict, body: bytes) -> tuple:
+    """HTTP route handler serving `render_metrics()`."""
+    return HTTPStatus.OK, "text/plain; version=0.0.4", render_metrics().encode()
+
+
+STAGE_SECONDS = Histogram(
+    "gemini_bot_stage_seconds",
+    "Time spent in each stage of the request pipeline.",
+)
+REQUEST_SECONDS = Histogram(
+    "gemini_bot_request_seconds",
+    "End-to-end handling time of a request.",
+)
+REQUESTS = Counter("gemini_bot_requests_total", "Requests handled, by kind, model and outcome.")
+ERRORS = Counter("gemini_bot_errors_total", "Errors while handling requests, by type.")
+TOKENS = Counter(
+    "gemini_bot_estimated_tokens_total",
+    "Estimated tokens sent to and received from each model.",
+)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    """Stage timings and outcome of one handled request."""
+
+    def __init__(self, kind: str, model: str):
+        self.kind = kind
+        self.model = model
+        self.stages = {}
+        self.error = None
+        self.started = time.perf_counter()
+
+
+@contextmanager
+def request_trace(kind: str, model: str):
+    """Trace a request: record its outcome and duration when the block exits."""
+    trace = RequestTrace(kind, model)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        record_error(type(e).__name__)
+        raise
+    finally:
+        _current_trace.reset(token)
+        elapsed = time.perf_counter() - trace.started
+        outcome = trace.error or "ok"
+        REQUEST_SECONDS.observe(elapsed, kind=kind)
+        REQUESTS.inc(kind=kind, model=trace.model, outcome=outcome)
+        if STRUCTURED_LOGS:
+            print(
+                json.dumps(
+                    {
+                        "event": "request",
+                        "kind": kind,
+                        "model": trace.model,
+                        "outcome": outcome,
+                        "seconds": round(elapsed, 4),
+                        "stages": {k: round(v, 4) for k, v in trace.stages.items()},
+                    }
+                )
+            )
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record the duration of a pipeline stage for the current request."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as a pipeline stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def record_error(error_type: str) -> None:
+    """Count an error and mark the current request as failed with it."""
+    ERRORS.inc(type=error_type)
+    trace = _current_trace.get()
+    if trace is not None and trace.error is None:
+        trace.error = error_type
+
+
+def record_tokens(model: str, prompt_tokens: int = 0, reply_tokens: int = 0) -> None:
+    """Count estimated prompt and reply tokens for a model."""
+    if prompt_tokens:
+        TOKENS.inc(prompt_tokens, model=model, direction="prompt")
+    if reply_tokens:
+        TOKENS.inc(reply_tokens, model=model, direction="reply")
@@ -0,0 +1,159 @@
+import asyncio
+import os
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from gemini_pro_bot.metrics import Counter, register_gauge
+from gemini_pro_bot.quota import TokenBucket
+
+# Bot API calls per second across all chats (Telegram allows about 30)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+# Messages per second to one private chat, and per minute to one group
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GROUP_RPM = float(os.getenv("TELEGRAM_GROUP_RPM", "20"))
+# Retries of a call that failed with a flood-wait (429 / RetryAfter) error
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+# Short bursts allowed within a single chat before calls are spaced out
+_CHAT_BURST = 3
+# Idle chat buckets are forgotten once this many chats were seen
+_MAX_CHAT_BUCKETS = 10000
+_EDIT_ENDPOINTS = ("editMessageText", "editMessageCaption", "editMessageReplyMarkup")
+
+OUTBOUND_REQUESTS = Counter(
+    "gemini_bot_telegram_requests_total",
+    "Bot API calls by endpoint and result (sent, merged, skipped, retried).",
+)
+
+
+class _PendingEdit:
+    """An edit of one message waiting for its turn; newer edits replace its content."""
+
+    def __init__(self, args):
+        self.args = args
+        self.future = asyncio.get_running_loop().create_future()
+        # Mark errors as retrieved when no merged edit is waiting for the result
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Schedules all Bot API calls within Telegram's flood limits.
+
+    Every call to a chat waits for a token of that chat's bucket, then of the
+    global bucket, so bursts are queued instead of rejected. Calls that still
+    hit a flood-wait error are retried after the advertised delay, during which
+    the chat's bucket hands out no tokens. Edits of a message that is already
+    waiting to be edited are merged: only the latest content is sent and every
+    caller gets its result. Chat actions only count against the global bucket
+    and are dropped rather than queued when it has no token to spare or
+    messages to the chat are waiting.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(TELEGRAM_GLOBAL_RATE * 60, burst=TELEGRAM_GLOBAL_RATE)
+        self._chats = {}
+        self._edits = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_CHAT_BUCKETS:
+                self._chats = {k: b for k, b in self._chats.items() if b.waiting}
+            try:
+                is_group = int(chat_id) < 0
+            except ValueError:
+                # "@channelusername"
+                is_group = True
+            if is_group:
+                bucket = TokenBucket(TELEGRAM_GROUP_RPM, burst=_CHAT_BURST)
+            else:
+                bucket = TokenBucket(TELEGRAM_CHAT_RATE * 60, burst=_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    @property
+    def queued(self) -> int:
+        """Number of calls waiting for a token."""
+        return self._global.waiting + sum(b.waiting for b in self._chats.values())
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # Not addressed to a chat (e.g. getMe, setWebhook, inline answers)
+            return await callback(*args, **kwargs)
+        chat_bucket = self._chat_bucket(chat_id)
+
+        if endpoint == "sendChatAction":
+            # Only a hint to the user; never worth delaying real messages for. It
+            # doesn't spend the chat's tokens, which streamed edits and follow-up
+            # chunks need, and is skipped while messages to the chat are queued.
+            if chat_bucket.waiting or not self._global.try_acquire():
+                OUTBOUND_REQUESTS.inc(endpoint=endpoint, result="skipped")
+                return True
+            return await self._send(callback, args, kwargs, endpoint, chat_bucket)
+
+        if endpoint in _EDIT_ENDPOINTS and "message_id" in data:
+            return await self._edit(callback, args, kwargs, endpoint, (chat_id, data["message_id"]))
+
+        await chat_bucket.acquire()
+        await self._global.acquire()
+        return await self._send(callback, args, kwargs, endpoint, chat_bucket)
+
+    async def _edit(self, callback, args, kwargs, endpoint, key):
+        pending = self._edits.get(key)
+        if pending is not None:
+            # An edit of this message is still waiting: send our content in its place
+            pending.args = args
+            OUTBOUND_REQUESTS.inc(endpoint=endpoint, result="merged")
+            return await asyncio.shield(pending.future)
+
+        pending = self._edits[key] = _PendingEdit(args)
+        chat_bucket = self._chat_bucket(key[0])
+        try:
+            await chat_bucket.acquire()
+            await self._global.acquire()
+        except BaseException:
+            pending.future.cancel()
+            raise
+        finally:
+            # Edits arriving from now on are sent separately, after this one
+            self._edits.pop(key, None)
+        try:
+            result = await self._send(callback, pending.args, kwargs, endpoint, chat_bucket)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                pending.future.set_exception(e)
+            else:
+                pending.future.cancel()
+            raise
+        pending.future.set_result(result)
+        return result
+
+    async def _send(self, callback, args, kwargs, endpoint, chat_bucket: TokenBucket):
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as ra:
+                if attempt >= TELEGRAM_MAX_RETRIES:
+                    raise
+                delay = ra.retry_after
+                print(f"Flood limit on {endpoint}, retrying in {delay}s")
+                OUTBOUND_REQUESTS.inc(endpoint=endpoint, result="retried")
+                chat_bucket.pause(delay)
+                await asyncio.sleep(delay)
+                continue
+            OUTBOUND_REQUESTS.inc(endpoint=endpoint, result="sent")
+            return result
+
+
+outbound_scheduler = OutboundScheduler()
+register_gauge(
+    "gemini_bot_telegram_queue_depth",
+    "Bot API calls waiting for a flood-limit token.",
+    lambda: outbound_scheduler.queued,
+)
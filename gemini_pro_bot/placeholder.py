@@ -0,0 +1,89 @@
+import asyncio
+import os
+from telegram import Message
+from telegram.constants import ChatAction
+from telegram.error import TelegramError
+from gemini_pro_bot.metrics import stage
+
+# Seconds to wait for a reply before sending a "Generating..." placeholder. Replies
+# ready sooner are sent directly. Set to 0 to always send the placeholder first.
+PLACEHOLDER_DELAY = float(os.getenv("PLACEHOLDER_DELAY", "1.0"))
+
+PLACEHOLDER_TEXT = "Generating..."
+# Telegram shows a chat action for about 5 seconds
+_TYPING_INTERVAL = 4.5
+
+
+class Placeholder:
+    """The bot's reply to a message, sent only once there is something to show.
+
+    While open, the typing action is shown and refreshed so it doesn't expire
+    during long generations. If nothing was sent after `PLACEHOLDER_DELAY`
+    seconds a "Generating..." message is sent. The first `edit_text` either
+    edits that message or, for fast replies, sends the text as the reply right
+    away, so it can be used wherever the placeholder `Message` used to be.
+
+    Use as an async context manager around the generation of the reply.
+    """
+
+    def __init__(self, message: Message, delay: float = PLACEHOLDER_DELAY):
+        self.message = message
+        self.delay = delay
+        self._reply = None
+        self._timer = None
+        self._typing = None
+
+    @property
+    def chat(self):
+        return self.message.chat
+
+    @property
+    def has_message(self) -> bool:
+        """Whether a reply message was sent (or is being sent)."""
+        return self._reply is not None
+
+    async def __aenter__(self) -> "Placeholder":
+        self._typing = asyncio.create_task(self._keep_typing())
+        if self.delay > 0:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self._send_placeholder)
+        else:
+            self._send_placeholder()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._typing.cancel()
+
+    async def _keep_typing(self) -> None:
+        while True:
+            try:
+                await self.message.chat.send_action(ChatAction.TYPING)
+            except TelegramError as e:
+                print("Failed to send typing action:", e)
+            await asyncio.sleep(_TYPING_INTERVAL)
+
+    async def _reply_with(self, text: str, **kwargs) -> Message:
+        with stage("placeholder"):
+            return await self.message.reply_text(
+                text=text, reply_to_message_id=self.message.message_id, **kwargs
+            )
+
+    def _send_placeholder(self) -> None:
+        if self._reply is None:
+            self._reply = asyncio.ensure_future(self._reply_with(PLACEHOLDER_TEXT))
+
+    async def get_message(self) -> Message:
+        """Get the reply message, sending the placeholder now if needed."""
+        self._send_placeholder()
+        return await self._reply
+
+    async def edit_text(self, text: str, **kwargs) -> Message:
+        """Show `text` as the reply, like `Message.edit_text` on the placeholder."""
+        if self._reply is None:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._reply = asyncio.ensure_future(self._reply_with(text, **kwargs))
+            return await self._reply
+        reply = await self._reply
+        return await reply.edit_text(text, **kwargs)
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import random
+import time
+from google.api_core.exceptions import TooManyRequests
+from gemini_pro_bot.executor import run_llm
+from gemini_pro_bot.llm import get_model_info_by_id
+
+# Requests per minute for models without an "rpm" entry in AVAILABLE_MODELS
+DEFAULT_MODEL_RPM = int(os.getenv("DEFAULT_MODEL_RPM", "10"))
+# Optional overrides for paid tiers, e.g. "gemini-2.5-pro=150,gemini-2.5-flash=1000"
+_RPM_OVERRIDES = {
+    k.strip(): int(v)
+    for k, _, v in (
+        i.partition("=") for i in os.getenv("MODEL_RPM", "").split(",") if "=" in i
+    )
+}
+# Retries after a 429 / RESOURCE_EXHAUSTED error, and the base backoff in seconds
+QUOTA_MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", "3"))
+QUOTA_BACKOFF_BASE = float(os.getenv("QUOTA_BACKOFF_BASE", "2"))
+
+
+class TokenBucket:
+    """An asyncio token bucket that hands out tokens in FIFO order.
+
+    The bucket holds up to `burst` tokens (`rpm` by default) and refills at `rpm`
+    tokens per minute, so short bursts pass straight through and sustained load
+    is smoothed to the quota instead of being rejected upstream.
+    """
+
+    def __init__(self, rpm: float, burst: float = None):
+        self.rpm = rpm
+        self.burst = burst or rpm
+        self._rate = rpm / 60.0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the upstream reported an exhausted quota."""
+        self._refill()
+        self._tokens = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds`, e.g. after a flood-wait error."""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0) - seconds * self._rate
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now, without waiting."""
+        self._refill()
+        if self._waiting or self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    @property
+    def waiting(self) -> int:
+        """Number of callers currently waiting for a token."""
+        return self._waiting
+
+    async def acquire(self, on_queued=None) -> None:
+        """Wait for a token.
+
+        Args:
+            on_queued: Optional coroutine function called with the caller's
+                1-based queue position when it has to wait.
+        """
+        position = self._waiting
+        self._waiting += 1
+        try:
+            self._refill()
+            if on_queued is not None and (position > 0 or self._tokens < 1):
+                await on_queued(position + 1)
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self._tokens) / self._rate)
+        finally:
+            self._waiting -= 1
+
+
+_buckets = {}
+
+
+def get_model_rpm(model_id: str) -> int:
+    """Get the requests-per-minute budget of a model."""
+    if model_id in _RPM_OVERRIDES:
+        return _RPM_OVERRIDES[model_id]
+    model_info = get_model_info_by_id(model_id) or {}
+    return model_info.get("rpm", DEFAULT_MODEL_RPM)
+
+
+def get_bucket(model_id: str) -> TokenBucket:
+    """Get the shared token bucket of a model, creating it on first use."""
+    bucket = _buckets.get(model_id)
+    if bucket is None:
+        bucket = _buckets[model_id] = TokenBucket(get_model_rpm(model_id))
+    return bucket
+
+
+async def call_model(model_id: str, func, *args, on_queued=None, **kwargs):
+    """Run a blocking Gemini call within the model's quota.
+
+    Waits for a token of the model's bucket, then runs `func` on the LLM executor.
+    On a 429 / RESOURCE_EXHAUSTED error the bucket is drained and the call is
+    retried up to `QUOTA_MAX_RETRIES` times with jittered exponential backoff.
+
+    Args:
+        model_id (str): The model the call is made against.
+        func: The blocking SDK callable, e.g. `chat.send_message`.
+        on_queued: Optional coroutine function called with the queue position
+            whenever the call has to wait for quota.
+
+    Returns:
+        The return value of `func`.
+
+    Raises:
+        TooManyRequests: If the quota is still exhausted after all retries.
+    """
+    bucket = get_bucket(model_id)
+    for attempt in range(QUOTA_MAX_RETRIES + 1):
+        await bucket.acquire(on_queued)
+        try:
+            return await run_llm(func, *args, **kwargs)
+        except TooManyRequests as e:
+            if attempt >= QUOTA_MAX_RETRIES:
+                raise
+            print(f"Quota exhausted for {model_id}, retrying:", e)
+            bucket.drain()
+            # Full jitter so throttled requests don't all retry at the same moment
+            await asyncio.sleep(random.uniform(0, QUOTA_BACKOFF_BASE * 2**attempt))
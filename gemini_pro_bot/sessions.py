@@ -0,0 +1,205 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+from gemini_pro_bot.llm import DEFAULT_MODEL, get_model
+
+# SQLite file that stores chat histories across restarts. Leave empty to disable.
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+# Seconds between background saves of changed chat sessions
+SESSION_SAVE_INTERVAL = float(os.getenv("SESSION_SAVE_INTERVAL", "30"))
+# Seconds of inactivity after which a saved chat is dropped from memory
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+
+_REVISION_KEY = "history_revision"
+
+
+def serialize_history(history) -> bytes:
+    """Serialize a chat history (a list of `glm.Content`) to compressed bytes."""
+    from google.ai import generativelanguage as glm
+
+    request = glm.GenerateContentRequest(contents=history)
+    return zlib.compress(glm.GenerateContentRequest.serialize(request))
+
+
+def deserialize_history(blob: bytes) -> list:
+    """Restore a chat history serialized by `serialize_history`."""
+    from google.ai import generativelanguage as glm
+
+    return list(glm.GenerateContentRequest.deserialize(zlib.decompress(blob)).contents)
+
+
+class SessionStore:
+    """SQLite-backed storage of each chat's history and selected model."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS chats (
+                    chat_id INTEGER PRIMARY KEY,
+                    selected_model TEXT NOT NULL,
+                    history BLOB NOT NULL,
+                    updated REAL NOT NULL
+                )"""
+            )
+
+    def load(self, chat_id: int):
+        """Return `(selected_model, history blob)` of a chat, or None if unknown."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT selected_model, history FROM chats WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+
+    def save_many(self, rows: list) -> None:
+        """Upsert `(chat_id, selected_model, history blob)` rows in one transaction."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """INSERT INTO chats (chat_id, selected_model, history, updated)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    selected_model = excluded.selected_model,
+                    history = excluded.history,
+                    updated = excluded.updated""",
+                [(chat_id, model, blob, now) for chat_id, model, blob in rows],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+
+
+def get_session_store():
+    """Open the session store on first use. Returns None if persistence is disabled."""
+    global _store
+    if _store is None and SESSION_DB_PATH:
+        _store = SessionStore(SESSION_DB_PATH)
+    return _store
+
+
+def _is_busy(chat_data: dict) -> bool:
+    lock = chat_data.get("turn_lock")
+    return bool((lock is not None and lock.locked()) or chat_data.get("pending_messages"))
+
+
+async def restore_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Rebuild a chat's session from the store the first time it is seen in memory.
+
+    Runs before all other handlers. The primary-key lookup is fast enough to do on
+    the event loop, which also keeps concurrent updates of the same chat from
+    restoring it twice.
+    """
+    chat_data = context.chat_data
+    if chat_data is None:
+        return
+    if "last_active" not in chat_data:
+        store = get_session_store()
+        row = store.load(update.effective_chat.id) if store else None
+        if row is not None:
+            selected_model, blob = row
+            chat_data["selected_model"] = selected_model
+            chat_data["chat"] = get_model(selected_model).start_chat(
+                history=deserialize_history(blob)
+            )
+            chat_data["saved_signature"] = _signature(chat_data)
+    chat_data["last_active"] = time.monotonic()
+
+
+def mark_history_changed(chat_data: dict) -> None:
+    """Record that a chat's history changed, so the next save writes it.
+
+    The history length is no fingerprint: once a chat reaches its turn limit,
+    every turn drops as many entries as it adds.
+    """
+    chat_data[_REVISION_KEY] = chat_data.get(_REVISION_KEY, 0) + 1
+
+
+def _signature(chat_data: dict):
+    """Cheap fingerprint of the persisted state, used to skip unchanged chats."""
+    chat = chat_data.get("chat")
+    if chat is None:
+        return None
+    return (id(chat), chat_data.get(_REVISION_KEY, 0), chat_data.get("selected_model", DEFAULT_MODEL))
+
+
+async def save_sessions(application: Application, evict: bool = True) -> None:
+    """Save changed chat sessions and drop idle ones from memory.
+
+    Only chats without a turn in flight are considered, so a history is never
+    read while a response is still streaming into it.
+    """
+    store = get_session_store()
+    if store is None:
+        return
+    from google.generativeai.types.generation_types import (
+        BrokenResponseError,
+        IncompleteIterationError,
+    )
+
+    rows = []
+    saved = []
+    idle = []
+    now = time.monotonic()
+    for chat_id, chat_data in list(application.chat_data.items()):
+        if _is_busy(chat_data):
+            continue
+        signature = _signature(chat_data)
+        if signature is not None and signature != chat_data.get("saved_signature"):
+            try:
+                history = chat_data["chat"].history
+            except (BrokenResponseError, IncompleteIterationError):
+                continue
+            rows.append((chat_id, signature[2], serialize_history(history)))
+            saved.append((chat_data, signature))
+        if evict and now - chat_data.get("last_active", now) > SESSION_IDLE_TIMEOUT:
+            idle.append(chat_id)
+    if rows:
+        await asyncio.to_thread(store.save_many, rows)
+        for chat_data, signature in saved:
+            chat_data["saved_signature"] = signature
+    for chat_id in idle:
+        chat_data = application.chat_data.get(chat_id)
+        # Skip chats that became active again while saving
+        if chat_data is not None and not _is_busy(chat_data) and (
+            now - chat_data.get("last_active", now) > SESSION_IDLE_TIMEOUT
+        ):
+            application.drop_chat_data(chat_id)
+
+
+async def _session_writer(application: Application) -> None:
+    while True:
+        await asyncio.sleep(SESSION_SAVE_INTERVAL)
+        try:
+            await save_sessions(application)
+        except Exception as e:
+            print("Saving chat sessions failed:", e)
+
+
+async def start_session_writer(application: Application) -> None:
+    """Start the background task that periodically saves and evicts sessions."""
+    if get_session_store() is not None:
+        application.bot_data["session_writer"] = asyncio.create_task(
+            _session_writer(application)
+        )
+
+
+async def stop_session_writer(application: Application) -> None:
+    """Stop the background writer and save every changed session one last time."""
+    global _store
+    task = application.bot_data.pop("session_writer", None)
+    if task is not None:
+        task.cancel()
+    if _store is not None:
+        await save_sessions(application, evict=False)
+        _store.close()
+        _store = None
@@ -0,0 +1,111 @@
+import os
+import time
+from gemini_pro_bot.executor import run_llm
+from gemini_pro_bot.html_format import TELEGRAM_MAX_LENGTH, utf16_len
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+# Stream responses into the placeholder message instead of waiting for the full reply
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").strip().lower() in ("1", "true", "yes")
+# Minimum seconds between two progressive edits of the same message
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+# Minimum number of new characters before another progressive edit is sent
+STREAM_EDIT_MIN_CHARS = int(os.getenv("STREAM_EDIT_MIN_CHARS", "80"))
+
+# Names of the `Candidate.FinishReason` values that end a reply normally
+_FINISHED_OK = ("FINISH_REASON_UNSPECIFIED", "STOP", "MAX_TOKENS")
+
+
+def get_chunk_text(chunk) -> str:
+    """Collect the text parts of a single streamed response chunk.
+
+    Args:
+        chunk: A `GenerateContentResponse` chunk yielded by a streamed response.
+
+    Returns:
+        str: The concatenated text of the chunk, or an empty string.
+    """
+    text = ""
+    if getattr(chunk, "candidates", None):
+        content = getattr(chunk.candidates[0], "content", None)
+        for part in getattr(content, "parts", None) or []:
+            txt = getattr(part, "text", None)
+            if txt:
+                text += txt
+    return text
+
+
+def get_preview_text(text: str) -> str:
+    """Build the plain-text preview shown while a reply is still streaming.
+
+    Args:
+        text (str): The text received so far.
+
+    Returns:
+        str: The preview, truncated to fit a single Telegram message.
+    """
+    if utf16_len(text) + 2 <= TELEGRAM_MAX_LENGTH:
+        return text + " …"
+    # Telegram counts UTF-16 code units; a surrogate pair cut in half is dropped
+    head = text.encode("utf-16-le")[: (TELEGRAM_MAX_LENGTH - 2) * 2]
+    return head.decode("utf-16-le", errors="ignore") + " …"
+
+
+async def stream_response(response, init_msg: Message) -> str:
+    """Read a streamed model response and progressively edit `init_msg`.
+
+    Chunks are pulled from the blocking SDK iterator on the LLM executor. Edits are
+    grouped so that at most one is sent every `STREAM_EDIT_INTERVAL` seconds and
+    only once `STREAM_EDIT_MIN_CHARS` new characters have arrived, which keeps the
+    bot under Telegram's edit rate limits. The first preview also waits one
+    interval, so replies that finish sooner are only sent once, formatted. The
+    preview is sent as plain text; the caller is responsible for the final
+    formatted render. Once the preview is cut at Telegram's length limit it can
+    no longer change, so no further edits are sent.
+
+    Args:
+        response: A `GenerateContentResponse` created with `stream=True`.
+        init_msg (Message): The placeholder message (or `Placeholder`) to update.
+
+    Returns:
+        str: The full plain text of the response.
+
+    Raises:
+        StopCandidateException: If the stream finished for a reason other than a
+            normal stop (e.g. SAFETY or RECITATION).
+    """
+    chunks = iter(response)
+    full_text = ""
+    sent_length = 0
+    capped = False
+    last_edit = time.monotonic()
+    while True:
+        chunk = await run_llm(next, chunks, None)
+        if chunk is None:
+            break
+        full_text += get_chunk_text(chunk)
+
+        now = time.monotonic()
+        if (
+            capped
+            or now - last_edit < STREAM_EDIT_INTERVAL
+            or len(full_text) - sent_length < STREAM_EDIT_MIN_CHARS
+        ):
+            continue
+        last_edit = now
+        try:
+            await init_msg.edit_text(get_preview_text(full_text))
+            sent_length = len(full_text)
+            capped = utf16_len(full_text) + 2 > TELEGRAM_MAX_LENGTH
+        except RetryAfter as ra:
+            # Back off until Telegram allows edits again
+            last_edit = now + ra.retry_after
+        except BadRequest as br:
+            print("Streaming edit failed:", br)
+
+    candidates = getattr(response, "candidates", None)
+    if candidates and candidates[0].finish_reason.name not in _FINISHED_OK:
+        from google.generativeai.types.generation_types import StopCandidateException
+
+        raise StopCandidateException(candidates[0])
+    return full_text
@@ -0,0 +1,94 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from telegram import Message
+
+# Seconds to wait for follow-up messages (e.g. a long paste split by Telegram)
+# before sending a turn to the model. Set to 0 to disable merging of idle chats.
+MESSAGE_COALESCE_WINDOW = float(os.getenv("MESSAGE_COALESCE_WINDOW", "0.3"))
+# Seconds to wait for the next photo of an album before answering the album as a whole
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.0"))
+# Upper bound on the total time spent collecting one album
+MEDIA_GROUP_MAX_WAIT = float(os.getenv("MEDIA_GROUP_MAX_WAIT", "4.0"))
+
+_TURN_LOCK_KEY = "turn_lock"
+_PENDING_KEY = "pending_messages"
+_MEDIA_GROUPS_KEY = "media_groups"
+
+
+@asynccontextmanager
+async def chat_turn(chat_data: dict, message: Message):
+    """Serialize model turns for a chat and merge messages that arrive in bursts.
+
+    The first message of a burst becomes the leader of the turn: it waits for any
+    in-flight turn of the same chat to finish, then for `MESSAGE_COALESCE_WINDOW`
+    seconds, and collects every message of the same sender queued in the
+    meantime. Messages that arrive while a leader is waiting are handed to that
+    leader and their own handler gets `None`. In groups, each sender's messages
+    form their own turns, so every user gets an answer.
+
+    Args:
+        chat_data (dict): The `context.chat_data` of the chat.
+        message (Message): The incoming message.
+
+    Yields:
+        list[Message] | None: The messages of this turn in arrival order, or
+        `None` if the message was merged into another turn.
+    """
+    sender = message.from_user.id if message.from_user else None
+    leaders = chat_data.setdefault(_PENDING_KEY, {})
+    pending = leaders.get(sender)
+    if pending is not None:
+        pending.append(message)
+        yield None
+        return
+
+    pending = leaders[sender] = [message]
+    lock = chat_data.get(_TURN_LOCK_KEY)
+    if lock is None:
+        lock = chat_data[_TURN_LOCK_KEY] = asyncio.Lock()
+    try:
+        async with lock:
+            if MESSAGE_COALESCE_WINDOW > 0:
+                await asyncio.sleep(MESSAGE_COALESCE_WINDOW)
+            leaders.pop(sender, None)
+            yield pending
+    finally:
+        # Don't leave a stale leader behind if the turn was cancelled while waiting
+        if leaders.get(sender) is pending:
+            leaders.pop(sender)
+
+
+async def collect_media_group(chat_data: dict, message: Message):
+    """Collect the messages of an album (media group) into a single batch.
+
+    Telegram delivers every photo of an album as a separate update. The first
+    update of a `media_group_id` waits until no new photo has arrived for
+    `MEDIA_GROUP_WINDOW` seconds (at most `MEDIA_GROUP_MAX_WAIT` in total) and
+    returns the whole album; the other updates return `None`.
+
+    Args:
+        chat_data (dict): The `context.chat_data` of the chat.
+        message (Message): A message with a `media_group_id`.
+
+    Returns:
+        list[Message] | None: The album's messages in arrival order, or `None` if
+        the message was added to an album collected by another update.
+    """
+    groups = chat_data.setdefault(_MEDIA_GROUPS_KEY, {})
+    group = groups.get(message.media_group_id)
+    if group is not None:
+        group.append(message)
+        return None
+
+    group = groups[message.media_group_id] = [message]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MEDIA_GROUP_MAX_WAIT
+    try:
+        seen = 0
+        while len(group) > seen and loop.time() < deadline:
+            seen = len(group)
+            await asyncio.sleep(min(MEDIA_GROUP_WINDOW, max(0.0, deadline - loop.time())))
+    finally:
+        groups.pop(message.media_group_id, None)
+    return group
@@ -0,0 +1,229 @@
+import asyncio
+import hmac
+import json
+import os
+import secrets
+from http import HTTPStatus
+from telegram import Update
+from telegram.ext import Application
+from gemini_pro_bot.lifecycle import (
+    mark_startup,
+    report_startup,
+    shutdown_application,
+    stop_event,
+)
+from gemini_pro_bot.metrics import metrics_endpoint
+
+# Public base URL Telegram should deliver updates to, e.g. https://geminiprobot.fly.dev
+# Leave empty to serve without registering the webhook (useful for local testing).
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Secret Telegram sends in X-Telegram-Bot-Api-Secret-Token with every update.
+# A random one is generated on each start if WEBHOOK_URL is set and this is empty.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+# Maximum number of updates waiting to be dispatched before new ones are refused
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "100"))
+# Seconds an incoming update may wait for room in the queue before a 503 is returned
+UPDATE_QUEUE_TIMEOUT = float(os.getenv("UPDATE_QUEUE_TIMEOUT", "1"))
+# Port for /metrics and /healthz in polling mode (0 disables; webhook mode serves them on PORT)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+_MAX_BODY_SIZE = 1 << 20
+_KEEP_ALIVE_TIMEOUT = 75
+
+
+class HTTPServer:
+    """A minimal asyncio HTTP/1.1 server for the webhook and status endpoints.
+
+    Route handlers are coroutine functions taking `(headers, body)` and returning
+    `(status, content type, payload bytes)`. Header names are lower-cased.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._server = None
+        self._connections = {}
+
+    def add_route(self, method: str, path: str, handler) -> None:
+        self._routes[(method, path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Idle keep-alive connections would otherwise hold up wait_closed()
+            for writer in self._connections:
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _dispatch(self, method: str, path: str, headers: dict, body: bytes) -> tuple:
+        handler = self._routes.get((method, path))
+        if handler is None:
+            known = any(route_path == path for _, route_path in self._routes)
+            status = HTTPStatus.METHOD_NOT_ALLOWED if known else HTTPStatus.NOT_FOUND
+            return status, "text/plain", status.phrase.encode()
+        try:
+            return await handler(headers, body)
+        except Exception as e:
+            print("HTTP handler error:", e)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, "text/plain", b"Internal Server Error"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), _KEEP_ALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, _ = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length", "0"))
+                except ValueError:
+                    await self._respond(
+                        writer, HTTPStatus.BAD_REQUEST, "text/plain", b"Bad Request", True
+                    )
+                    break
+                if length > _MAX_BODY_SIZE:
+                    await self._respond(
+                        writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "text/plain", b"Too Large", True
+                    )
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                path = target.split("?", 1)[0]
+                status, content_type, payload = await self._dispatch(method, path, headers, body)
+                close = headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, content_type, payload, close)
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, content_type: str, payload: bytes, close: bool) -> None:
+        status = HTTPStatus(status)
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n"
+        )
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + payload)
+        await writer.drain()
+
+
+def make_update_handler(application: Application, secret: str = WEBHOOK_SECRET):
+    """Build the route handler that feeds webhook updates into the Application.
+
+    Requests without `secret` in X-Telegram-Bot-Api-Secret-Token are refused
+    with a 403; an empty `secret` accepts every request. Updates are put into the application's bounded update queue. When the queue
+    stays full for `UPDATE_QUEUE_TIMEOUT` seconds the update is refused with a
+    503, and Telegram redelivers it later, which pushes back on bursts instead of
+    buffering them without limit.
+    """
+
+    async def handle_update(headers: dict, body: bytes) -> tuple:
+        if secret and not hmac.compare_digest(
+            headers.get("x-telegram-bot-api-secret-token", ""), secret
+        ):
+            return HTTPStatus.FORBIDDEN, "text/plain", b"Forbidden"
+        try:
+            data = json.loads(body)
+            # de_json returns None for an empty object, which must not reach the queue
+            if not isinstance(data, dict) or not data:
+                raise ValueError("Expected a non-empty JSON object")
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError, KeyError):
+            return HTTPStatus.BAD_REQUEST, "text/plain", b"Bad Request"
+        try:
+            await asyncio.wait_for(application.update_queue.put(update), UPDATE_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return HTTPStatus.SERVICE_UNAVAILABLE, "text/plain", b"Busy"
+        return HTTPStatus.OK, "text/plain", b"OK"
+
+    return handle_update
+
+
+async def health(headers: dict, body: bytes) -> tuple:
+    return HTTPStatus.OK, "text/plain", b"OK"
+
+
+async def start_status_server(application: Application) -> None:
+    """Serve /metrics and /healthz on `METRICS_PORT` while polling."""
+    if not METRICS_PORT:
+        return
+    server = HTTPServer(WEBHOOK_LISTEN, METRICS_PORT)
+    server.add_route("GET", "/healthz", health)
+    server.add_route("GET", "/metrics", metrics_endpoint)
+    await server.start()
+    application.bot_data["status_server"] = server
+    print(f"Metrics server listening on {WEBHOOK_LISTEN}:{METRICS_PORT}")
+
+
+async def stop_status_server(application: Application) -> None:
+    """Stop the server started by `start_status_server`, if any."""
+    server = application.bot_data.pop("status_server", None)
+    if server is not None:
+        await server.stop()
+
+
+async def run_webhook(application: Application, server: HTTPServer = None) -> None:
+    """Run the Application behind the embedded HTTP server until SIGINT/SIGTERM.
+
+    Mirrors the lifecycle of `Application.run_polling`, including the
+    `post_init`, `post_stop` and `post_shutdown` callbacks. On shutdown the
+    server stops first, so no new updates are accepted while in-flight
+    requests are drained.
+    """
+    if server is None:
+        server = HTTPServer(WEBHOOK_LISTEN, WEBHOOK_PORT)
+    secret = WEBHOOK_SECRET
+    if WEBHOOK_URL and not secret:
+        # A public endpoint without a secret would accept forged updates from anyone
+        secret = secrets.token_urlsafe(32)
+    server.add_route("POST", WEBHOOK_PATH, make_update_handler(application, secret))
+    server.add_route("GET", "/healthz", health)
+    server.add_route("GET", "/metrics", metrics_endpoint)
+
+    stop = stop_event()
+    await application.initialize()
+    mark_startup("initialize")
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        mark_startup("post_init")
+        await application.start()
+        await server.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        mark_startup("webhook")
+        report_startup()
+        print(f"Webhook server listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        await shutdown_application(application, server.stop)
@@ -1,4 +1,12 @@
-from gemini_pro_bot.bot import start_bot
+import sys
 
 if __name__ == "__main__":
-    start_bot()
+    if sys.argv[1:2] == ["batch"]:
+        # Offline mode: run a JSONL file of prompts, see gemini_pro_bot/batch.py
+        from gemini_pro_bot.batch import main
+
+        main(sys.argv[2:])
+    else:
+        from gemini_pro_bot.bot import start_bot
+
+        start_bot()